@@ -69,17 +69,23 @@ class BaseActionManager(object):
         pass
 
     @abc.abstractmethod
-    def wait_cbinit_service(self):
-        """Wait if the CloudBase Init Service to stop."""
+    def wait_cbinit_service(self, policy=None):
+        """Wait if the CloudBase Init Service to stop.
+
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
+        """
         pass
 
     @abc.abstractmethod
-    def check_cbinit_service(self, searched_paths=None):
+    def check_cbinit_service(self, searched_paths=None, policy=None):
         """Check if the CloudBase Init service started.
 
         :param searched_paths:
             Paths to files that should exist if the hearbeat patch is
             aplied.
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
         """
         pass
 
@@ -95,8 +101,12 @@ class BaseActionManager(object):
         pass
 
     @abc.abstractmethod
-    def wait_boot_completion(self):
-        """Wait for the instance to be booted a resonable period."""
+    def wait_boot_completion(self, policy=None):
+        """Wait for the instance to be booted a resonable period.
+
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
+        """
         pass
 
     @abc.abstractmethod
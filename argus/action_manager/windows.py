@@ -13,28 +13,44 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import socket
+import threading
 import urlparse
 
 
 from argus.action_manager import base
+from argus.client import bundle
+from argus.client import conditions
+from argus.client import reboot
 from argus import exceptions
+from argus import retry
 from argus import util
-import requests
-from winrm import exceptions as winrm_exceptions
 
 LOG = util.LOG
 
-
-def wait_boot_completion(client, username):
+# The number of seconds after which a download is terminated.
+DOWNLOAD_TIMEOUT = 10 * 60
+# The number of seconds after which the installer is terminated.
+INSTALL_TIMEOUT = 30 * 60
+INSTALLER_URL = "http://www.cloudbase.it/downloads/{}"
+# The retry policy of waiting for an instance to boot, when none
+# is given. The cheap readiness probes are made for as long as
+# a reboot is waited for, no matter how many of them fail.
+BOOT_POLICY = retry.RetryPolicy(deadline=reboot.REBOOT_TIMEOUT)
+
+
+def wait_boot_completion(client, username, policy=None):
+    # Wait with the cheap probes, then query the accounts, which
+    # is expected to succeed right away.
+    client.wait_ready(policy=policy or BOOT_POLICY)
     wait_cmd = ('(Get-CimInstance Win32_Account | '
                 'where -Property Name -contains {0}).Name'
                 .format(username))
     client.run_command_until_condition(
         wait_cmd,
-        lambda stdout: stdout.strip() == username,
+        conditions.Equals(username),
         retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
+        command_type=util.POWERSHELL, policy=policy,
+        retry_exit_codes=True)
 
 
 class WindowsActionManager(base.BaseActionManager):
@@ -44,6 +60,7 @@ class WindowsActionManager(base.BaseActionManager):
 
     def __init__(self, client, config, os_type=util.WINDOWS):
         super(WindowsActionManager, self).__init__(client, config, os_type)
+        self._bundle = None
 
     def download(self, uri, location):
         """Download the resource locatet at a specific uri in the location.
@@ -55,22 +72,72 @@ class WindowsActionManager(base.BaseActionManager):
             Path from the instance in which we should download the
             remote resouce.
         """
+        server = self._get_resource_server()
+        if server is not None:
+            uri = server.rewrite(uri)
         LOG.debug("Downloading from %s to %s ", uri, location)
         cmd = ("Invoke-WebRequest -Uri {} "
                "-OutFile {}".format(uri, location))
         self._client.run_command_with_retry(cmd,
                                             count=util.RETRY_COUNT,
                                             delay=util.RETRY_DELAY,
-                                            command_type=util.POWERSHELL)
+                                            command_type=util.POWERSHELL,
+                                            retry_exit_codes=True,
+                                            timeout=DOWNLOAD_TIMEOUT)
+
+    def _get_resource_server(self):
+        """Get the resource server of the host, if it is enabled."""
+        if not self._conf.argus.resource_server:
+            return None
+        # Imported only when needed, since the server requires cherrypy.
+        from argus.scenarios.cloud import resource_server
+        return resource_server.get_resource_server()
+
+    def _get_resource_bundle(self):
+        """Get the resources pushed in the instance, if they are used.
+
+        The bundle is pushed on first use. If this fails, the resources
+        are downloaded from the instance, as usual.
+        """
+        if not self._conf.argus.resource_bundle or self._bundle is False:
+            return None
+        if self._bundle is None:
+            resource_bundle = bundle.ResourceBundle(self._client)
+            try:
+                resource_bundle.push()
+            except exceptions.ArgusError as exc:
+                LOG.warning("The resources can't be pushed in the "
+                            "instance, downloading them instead: %s", exc)
+                self._bundle = False
+                return None
+            self._bundle = resource_bundle
+        return self._bundle
 
     def download_resource(self, resource_location, location):
         """Download the resource in the specified location
 
+        When the resource bundle is enabled, the resource is copied
+        from the bundle pushed in the instance instead. When the
+        resource server is enabled, the resource is downloaded from it.
+
         :param resource_script:
             Is relative to the /argus/resources/ directory.
         :param location:
             The location on the instance.
         """
+        resource_bundle = self._get_resource_bundle()
+        if (resource_bundle is not None and
+                resource_location in resource_bundle):
+            LOG.debug("Copying the bundled resource %s to %s",
+                      resource_location, location)
+            resource_bundle.copy(resource_location, location)
+            return
+
+        server = self._get_resource_server()
+        if server is not None:
+            self.download(server.resource_url(resource_location), location)
+            return
+
         base_resource = self._conf.argus.resources
         if not base_resource.endswith("/"):
             base_resource = urlparse.urljoin(self._conf.argus.resources,
@@ -79,8 +146,12 @@ class WindowsActionManager(base.BaseActionManager):
         self.download(uri, location)
 
     def _execute_resource_script(self, resource_location, parameters,
-                                 script_type):
-        """Run a resource script with with the specific parameters."""
+                                 script_type, timeout=None):
+        """Run a resource script with with the specific parameters.
+
+        :param timeout:
+            The number of seconds after which the script is terminated.
+        """
         LOG.debug("Executing resource script %s with this parameters %s",
                   resource_location, parameters)
 
@@ -93,14 +164,16 @@ class WindowsActionManager(base.BaseActionManager):
         self._client.run_command_with_retry(cmd,
                                             count=util.RETRY_COUNT,
                                             delay=util.RETRY_DELAY,
-                                            command_type=script_type)
+                                            command_type=script_type,
+                                            on_line=LOG.debug,
+                                            timeout=timeout)
 
     def execute_powershell_resource_script(self, resource_location,
-                                           parameters=""):
+                                           parameters="", timeout=None):
         """Execute a powershell resource script."""
         self._execute_resource_script(
             resource_location=resource_location, parameters=parameters,
-            script_type=util.POWERSHELL_SCRIPT_BYPASS)
+            script_type=util.POWERSHELL_SCRIPT_BYPASS, timeout=timeout)
 
     def execute_cmd_resource_script(self, resource_location,
                                     parameters=""):
@@ -131,10 +204,14 @@ class WindowsActionManager(base.BaseActionManager):
 
         parameters = '-serviceType {} -installer {}'.format(service_type,
                                                             installer)
+        server = self._get_resource_server()
+        if server is not None:
+            parameters += ' -installerUrl {}'.format(
+                server.cache_url(INSTALLER_URL.format(installer)))
         try:
             self.execute_powershell_resource_script(
                 resource_location='windows/installCBinit.ps1',
-                parameters=parameters)
+                parameters=parameters, timeout=INSTALL_TIMEOUT)
         except exceptions.ArgusError:
             # This can happen for multiple reasons,
             # but one of them is the fact that the installer
@@ -156,12 +233,12 @@ class WindowsActionManager(base.BaseActionManager):
         cmd = r"C:\{}".format(resource_location.split('/')[-1])
         self.download_resource(resource_location, cmd)
         LOG.debug("Running %s ", cmd)
+        self._client.expect_reboot()
         try:
-            self._client.run_remote_cmd(
-                cmd, command_type=util.POWERSHELL_SCRIPT_BYPASS)
-        except (socket.error, winrm_exceptions.WinRMTransportError,
-                winrm_exceptions.InvalidCredentialsError,
-                requests.ConnectionError, requests.Timeout):
+            self._client.stream_command(
+                cmd, command_type=util.POWERSHELL_SCRIPT_BYPASS,
+                on_line=LOG.info)
+        except retry.SESSION_ERRORS:
             # After executing sysprep.ps1 the instance will reboot and
             # it is normal to have conectivity issues during that time.
             # Knowing this we have to except this kind of errors.
@@ -169,6 +246,7 @@ class WindowsActionManager(base.BaseActionManager):
             # created on different windows images.
             LOG.debug("Currently rebooting...")
         LOG.info("Wait for the machine to finish rebooting ...")
+        self._client.wait_for_reboot()
         self.wait_boot_completion()
 
     def git_clone(self, repo_url, location):
@@ -184,40 +262,49 @@ class WindowsActionManager(base.BaseActionManager):
         self._client.run_command_with_retry(cmd,
                                             count=util.RETRY_COUNT,
                                             delay=util.RETRY_DELAY,
-                                            command_type=util.CMD)
+                                            command_type=util.CMD,
+                                            retry_exit_codes=True)
+
+    def wait_cbinit_service(self, policy=None):
+        """Wait if the CloudBase Init Service to stop.
 
-    def wait_cbinit_service(self):
-        """Wait if the CloudBase Init Service to stop."""
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
+        """
         wait_cmd = ('(Get-Service | where -Property Name '
                     '-match cloudbase-init).Status')
 
         self._client.run_command_until_condition(
             wait_cmd,
-            lambda out: out.strip() == 'Stopped',
+            conditions.Equals('Stopped'),
             retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-            command_type=util.POWERSHELL)
+            command_type=util.POWERSHELL, policy=policy)
 
-    def check_cbinit_service(self, searched_paths=None):
+    def check_cbinit_service(self, searched_paths=None, policy=None):
         """Check if the CloudBase Init service started.
 
         :param searched_paths:
             Paths to files that should exist if the hearbeat patch is
             aplied.
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
         """
-        test_cmd = 'Test-Path {}'
-        check_cmds = [test_cmd.format(path) for path in searched_paths or []]
-        for check_cmd in check_cmds:
+        for path in searched_paths or []:
+            exists = conditions.PathExists(path)
             self._client.run_command_until_condition(
-                check_cmd,
-                lambda out: out.strip() == 'True',
+                exists.command, exists,
                 retry_count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-                command_type=util.POWERSHELL)
+                command_type=util.POWERSHELL, policy=policy)
+
+    def wait_boot_completion(self, policy=None):
+        """Wait for a resonable amount of time the instance to boot.
 
-    def wait_boot_completion(self):
-        """Wait for a resonable amount of time the instance to boot."""
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` used for polling.
+        """
         LOG.info("Waiting for boot completion...")
         username = self._conf.openstack.image_username
-        wait_boot_completion(self._client, username)
+        wait_boot_completion(self._client, username, policy=policy)
 
     def specific_prepare(self):
         """Prepare some OS specific resources."""
@@ -323,72 +410,60 @@ WindowsActionManagers = {
 }
 
 
-def _is_nanoserver(client):
-    """Returns True if the client is connected to a nanoserver machine.
-
-       Using the powershell code from here: https://goo.gl/UD27SK
-    """
-    server_level_key = (r'HKLM:\Software\Microsoft\Windows NT\CurrentVersion'
-                        r'\Server\ServerLevels')
-
-    cmd = r'Test-Path "{}"'.format(server_level_key)
-    path_exists, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
+# The OS fingerprints, keyed by the hostname and the instance ID.
+_OS_FINGERPRINTS = {}
+_OS_FINGERPRINTS_LOCK = threading.Lock()
 
-    if path_exists == "False":
-        return False
+# Get the major version, the product type and whether the OS is a
+# Nano Server, all at once. The Nano Server detection uses the
+# powershell code from here: https://goo.gl/UD27SK
+_OS_FINGERPRINT_CMD = (
+    r"$k='HKLM:\Software\Microsoft\Windows NT\CurrentVersion"
+    r"\Server\ServerLevels';$n=0;"
+    r"if((Test-Path $k) -and "
+    r"([string](Get-ItemProperty $k).NanoServer).StartsWith('1')){$n=1};"
+    r"'{0} {1} {2}' -f [System.Environment]::OSVersion.Version.Major,"
+    r"(Get-CimInstance -Class Win32_OperatingSystem).ProductType,$n")
 
-    cmd = r'(Get-ItemProperty "{}").NanoServer'.format(server_level_key)
-    nanoserver_property, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
 
-    return len(nanoserver_property) > 0 and nanoserver_property[0] == "1"
-
-
-def _get_major_version(client):
-    """Return the major version of the OS.
-
-    :param client:
-        A Windows Client.
-    """
-    cmd = r"[System.Environment]::OSVersion.Version.Major"
-    major_version, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-    return int(major_version.strip())
-
-
-def _get_product_type(client):
-    """Return the minor version of the OS.
+def _get_os_fingerprint(client):
+    """Return the major version, the product type and the Nano Server flag.
 
     :param client:
         A Windows Client.
     """
-    cmd = r"(Get-CimInstance -Class Win32_OperatingSystem).producttype"
-    product_type, _, _ = client.run_command_with_retry(
-        cmd, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
-        command_type=util.POWERSHELL)
-    return int(product_type.strip())
+    stdout, _, _ = client.run_command_with_retry(
+        _OS_FINGERPRINT_CMD, count=util.RETRY_COUNT, delay=util.RETRY_DELAY,
+        command_type=util.POWERSHELL, retry_exit_codes=True)
+    major_version, product_type, is_nanoserver = stdout.split()
+    return int(major_version), int(product_type), is_nanoserver == "1"
 
 
 def get_windows_action_manager(client):
-    """Get the OS specific Action Manager."""
-    LOG.info("Waiting for boot completion in order to select an "
-             "Action Manager ...")
-
-    conf = util.get_config()
-    username = conf.openstack.image_username
-    wait_boot_completion(client, username)
+    """Get the OS specific Action Manager.
 
-    # get os type
-    product_type = _get_product_type(client)
-    major_version = _get_major_version(client)
+    The OS fingerprint is cached for the host and the instance ID
+    of the client, so other clients of the same instance don't have
+    to wait for the boot completion or to probe the OS again.
+    """
+    key = (client.hostname, client.instance_id)
+    with _OS_FINGERPRINTS_LOCK:
+        fingerprint = _OS_FINGERPRINTS.get(key)
+
+    if fingerprint is None:
+        LOG.info("Waiting for boot completion in order to select an "
+                 "Action Manager ...")
+        conf = util.get_config()
+        username = conf.openstack.image_username
+        wait_boot_completion(client, username)
+        fingerprint = _get_os_fingerprint(client)
+        if client.instance_id is not None:
+            with _OS_FINGERPRINTS_LOCK:
+                _OS_FINGERPRINTS[key] = fingerprint
+
+    major_version, product_type, is_nanoserver = fingerprint
     windows_type = util.WINDOWS_VERSION.get((major_version, product_type),
                                             util.WINDOWS)
-    is_nanoserver = _is_nanoserver(client)
-
     if isinstance(windows_type, dict):
         windows_type = windows_type[is_nanoserver]
 
@@ -139,6 +139,28 @@ class CloudBackend(BaseBackend):
     def public_key(self):
         """Get the underlying public key."""
 
+    # pylint: disable=unused-argument; left for subclasses
+    def restore_snapshot(self, installation):
+        """Rebuild the instance from a snapshot of the given installation.
+
+        :param installation:
+            A dictionary describing the installation of cloudbaseinit.
+        :returns:
+            True if the instance was rebuilt, False if there's no
+            such snapshot or the backend doesn't support them.
+        """
+        return False
+
+    # pylint: disable=unused-argument; left for subclasses
+    def save_snapshot(self, installation):
+        """Snapshot the instance, after the given installation.
+
+        :returns:
+            True if the instance was snapshotted, and thus restarted,
+            False if the backend doesn't support snapshots.
+        """
+        return False
+
     @abc.abstractmethod
     def floating_ip(self):
         """Get the floating ip that was attached to the underlying instance."""
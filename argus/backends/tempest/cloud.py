@@ -189,6 +189,7 @@ class RescueWindowsBackend(tempest_backend.BaseWindowsTempestBackend):
         waiters.wait_for_server_status(
             self._manager.servers_client,
             self.internal_instance_id(), 'RESCUE')
+        self._disk_changed()
 
     def unrescue_server(self):
         """Unrescue the underlying instance."""
@@ -197,3 +198,4 @@ class RescueWindowsBackend(tempest_backend.BaseWindowsTempestBackend):
         waiters.wait_for_server_status(
             self._manager.servers_client,
             self.internal_instance_id(), 'ACTIVE')
+        self._disk_changed()
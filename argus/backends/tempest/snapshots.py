@@ -0,0 +1,154 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reuse the instances in which cloudbase-init was already installed.
+
+After a recipe installed cloudbase-init, the instance is stopped and
+snapshotted, and the snapshot is tagged with a key describing the
+installation: the image, the installer and the patches applied to it.
+The next scenarios with the same key rebuild their instance from the
+snapshot, instead of installing cloudbase-init again.
+
+The snapshots are regular images of the cloud, so they are reused
+across runs, as long as the credentials of the backends can see
+them, which is the case with pre-provisioned credentials. The ones
+which are too old, or beyond the maximum number of snapshots with the
+same key, are deleted when the snapshots of that key are looked up or
+saved. The snapshots of other installations are left alone, since they
+might be used by other runs.
+"""
+
+import calendar
+import hashlib
+import json
+import time
+
+from argus import util
+
+with util.restore_excepthook():
+    from tempest.common import waiters
+
+
+LOG = util.get_logger()
+
+# The metadata of the images which are snapshots of argus.
+KEY_PROPERTY = "argus_snapshot_key"
+ACTIVE = "ACTIVE"
+
+_CREATED_FORMAT = "%Y-%m-%dT%H:%M:%SZ"
+
+
+def snapshot_key(**fields):
+    """Get the key of the snapshots of the installation with these fields."""
+    data = json.dumps(fields, sort_keys=True).encode("utf-8")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _created(image):
+    return calendar.timegm(time.strptime(image["created"], _CREATED_FORMAT))
+
+
+class SnapshotCache(object):
+    """The snapshots of the installed instances.
+
+    :param manager:
+        The :class:`argus.backends.tempest.manager.APIManager`
+        used for managing the snapshots.
+    :param max_age: The number of seconds a snapshot is reused.
+    :param max_count: The maximum number of snapshots.
+    """
+
+    def __init__(self, manager, max_age, max_count):
+        self._manager = manager
+        self._max_age = max_age
+        self._max_count = max_count
+
+    def _snapshots(self, key):
+        images = self._manager.compute_images_client.list_images(
+            detail=True)['images']
+        return [image for image in images
+                if (image.get("metadata") or {}).get(KEY_PROPERTY) == key]
+
+    def _delete(self, image, reason):
+        LOG.info("Deleting the snapshot %s, %s.", image["id"], reason)
+        try:
+            self._manager.compute_images_client.delete_image(image["id"])
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.warning("The snapshot %s can't be deleted: %r",
+                        image["id"], exc)
+
+    def evict(self, key):
+        """Delete the old snapshots with the given key, and the ones
+        beyond the limit.
+
+        :returns: The snapshots with the key which were kept, newest first.
+        """
+        now = time.time()
+        kept = []
+        for image in sorted(self._snapshots(key), key=_created,
+                            reverse=True):
+            if now - _created(image) > self._max_age:
+                self._delete(image, "since it's too old")
+            elif len(kept) >= self._max_count:
+                self._delete(image, "since there are too many snapshots")
+            else:
+                kept.append(image)
+        return kept
+
+    def find(self, key):
+        """Get the ID of the newest snapshot with the given key, if any."""
+        for image in self.evict(key):
+            if image["status"] == ACTIVE:
+                return image["id"]
+        return None
+
+    def save(self, server_id, key):
+        """Snapshot the given server, with the given key.
+
+        The server is stopped while it's snapshotted, so that
+        its disks are consistent, and started again afterwards.
+
+        :returns: The ID of the snapshot.
+        """
+        servers_client = self._manager.servers_client
+        images_client = self._manager.compute_images_client
+        started = time.time()
+
+        servers_client.stop_server(server_id)
+        waiters.wait_for_server_status(servers_client, server_id, 'SHUTOFF')
+        try:
+            response = images_client.create_image(
+                server_id, name=util.rand_name("argus-snapshot"),
+                metadata={KEY_PROPERTY: key})
+            image_id = (response.get("image_id") or
+                        response.response["location"].rsplit("/", 1)[-1])
+            finished = False
+            try:
+                waiters.wait_for_image_status(images_client, image_id,
+                                              ACTIVE)
+                finished = True
+            finally:
+                if not finished:
+                    # A failed snapshot must not be found later.
+                    self._delete({"id": image_id}, "since it failed")
+        finally:
+            servers_client.start_server(server_id)
+            waiters.wait_for_server_status(servers_client, server_id,
+                                           'ACTIVE')
+
+        LOG.info("Saved the snapshot %s of the instance %s in %.1f "
+                 "seconds.", image_id, server_id, time.time() - started)
+        self.evict(key)
+        return image_id
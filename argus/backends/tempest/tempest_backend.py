@@ -22,7 +22,9 @@ import six
 from argus.backends import base as base_backend
 from argus.backends import windows
 from argus.backends.tempest import manager as api_manager
+from argus.backends.tempest import snapshots
 from argus import exceptions
+from argus.introspection.cloud import windows as introspection
 from argus import util
 
 with util.restore_excepthook():
@@ -75,6 +77,11 @@ class BaseTempestBackend(base_backend.CloudBackend):
         self.image_ref = self._conf.openstack.image_ref
         self.flavor_ref = self._conf.openstack.flavor_ref
         self._manager = api_manager.APIManager()
+        self._snapshots = None
+        if self._conf.argus.snapshot_cache:
+            self._snapshots = snapshots.SnapshotCache(
+                self._manager, self._conf.argus.snapshot_max_age * 60 * 60,
+                self._conf.argus.snapshot_max_count)
 
     def _configure_networking(self):
         subnet_id = self._manager.primary_credentials().subnet["id"]
@@ -231,6 +238,58 @@ class BaseTempestBackend(base_backend.CloudBackend):
         # Delegate to the manager to reboot the instance
         return self._manager.reboot_instance(self.internal_instance_id())
 
+    def restore_snapshot(self, installation):
+        if self._snapshots is None:
+            return False
+        status = self.instance_server()['status']
+        if status != 'ACTIVE':
+            # For instance, a rescued instance can't be rebuilt.
+            LOG.info("The instance is %s, it will not be restored from "
+                     "a snapshot.", status)
+            return False
+        try:
+            image_id = self._snapshots.find(
+                snapshots.snapshot_key(**installation))
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.warning("The snapshots can't be looked up: %r", exc)
+            return False
+        if image_id is None:
+            LOG.info("There's no snapshot of this installation yet.")
+            return False
+
+        LOG.info("Rebuilding the instance from the snapshot %s...", image_id)
+        try:
+            self._manager.servers_client.rebuild_server(
+                self.internal_instance_id(), image_id)
+            waiters.wait_for_server_status(
+                self._manager.servers_client, self.internal_instance_id(),
+                'ACTIVE')
+        except Exception as exc:  # pylint: disable=broad-except
+            # The snapshot might have been deleted meanwhile by another
+            # run, in which case the instance is left as it was.
+            status = self.instance_server()['status']
+            if status != 'ACTIVE':
+                raise exceptions.ArgusError(
+                    "Rebuilding the instance from the snapshot {} failed, "
+                    "leaving it {}: {!r}".format(image_id, status, exc))
+            LOG.warning("The instance can't be rebuilt from the snapshot "
+                        "%s, installing instead: %r", image_id, exc)
+            return False
+        return True
+
+    def save_snapshot(self, installation):
+        if self._snapshots is None:
+            return False
+        LOG.info("Saving a snapshot of the instance...")
+        try:
+            self._snapshots.save(self.internal_instance_id(),
+                                 snapshots.snapshot_key(**installation))
+        except Exception as exc:  # pylint: disable=broad-except
+            # A missing snapshot only costs the next scenarios
+            # an installation, so the scenario goes on.
+            LOG.warning("The instance can't be snapshotted: %r", exc)
+        return True
+
     def instance_password(self):
         # Delegate to the manager to find out the instance password
         return self._manager.instance_password(
@@ -269,6 +328,26 @@ class BaseWindowsTempestBackend(windows.WindowsBackendMixin,
                                 BaseTempestBackend):
     """Base Tempest backend for testing Windows."""
 
+    def _disk_changed(self):
+        """Forget what was learned about the disk of the instance."""
+        self.remote_client.invalidate_shells()
+        introspection.invalidate_install_layout(self.remote_client)
+
+    def restore_snapshot(self, installation):
+        restored = super(BaseWindowsTempestBackend, self).restore_snapshot(
+            installation)
+        if restored:
+            self._disk_changed()
+        return restored
+
+    def save_snapshot(self, installation):
+        saved = super(BaseWindowsTempestBackend, self).save_snapshot(
+            installation)
+        if saved:
+            # The instance was restarted.
+            self.remote_client.invalidate_shells()
+        return saved
+
     def _get_log_template(self, suffix):
         template = super(BaseWindowsTempestBackend, self)._get_log_template(suffix)
         if self._conf.argus.build and self._conf.argus.arch:
@@ -29,8 +29,11 @@ class WindowsBackendMixin(object):
             username = self._conf.openstack.image_username
         if password is None:
             password = self._conf.openstack.image_password
+        use_agent = self._conf.argus.powershell_agent
         return windows.WinRemoteClient(self.floating_ip(),
                                        username, password,
-                                       transport_protocol=protocol)
+                                       transport_protocol=protocol,
+                                       use_agent=use_agent,
+                                       instance_id=self.internal_instance_id())
 
     remote_client = util.cached_property(get_remote_client, 'remote_client')
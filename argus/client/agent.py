@@ -0,0 +1,185 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A long-lived PowerShell process in the instance, executing requests.
+
+The agent is started with a single WinRM command, which never ends
+until the agent is stopped. Every request is a JSON line sent to the
+standard input of the agent, which executes the requested script in
+its own runspace, then writes a JSON line with the result, prefixed
+by an unique marker, to its standard output.
+
+Since the scripts share the agent's process, they must not call
+``exit``. Doing so kills the agent, which is started again for the
+next request, and fails the request with :class:`AgentError`.
+"""
+
+import itertools
+import json
+import threading
+
+import six
+
+from argus.client import batch
+from argus.client import streaming
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+_AGENT_SCRIPT = r"""$m='{marker}'
+[Console]::OutputEncoding=New-Object Text.UTF8Encoding $false
+[Console]::Out.WriteLine("$m ready");[Console]::Out.Flush()
+while(($l=[Console]::In.ReadLine()) -ne $null){{
+if(!$l){{continue}};$q=ConvertFrom-Json $l;$o='';$e='';$x=0
+try{{$c=$q.script
+{runner}}}
+catch{{$e=$_|Out-String;$x=1}}
+$j=ConvertTo-Json -Compress @{{id=$q.id;stdout=[string]$o;
+stderr=[string]$e;exit_code=$x}}
+[Console]::Out.WriteLine("$m $j");[Console]::Out.Flush()}}
+"""
+
+
+def _to_text(data):
+    if isinstance(data, six.binary_type):
+        return data.decode("utf-8", "replace")
+    return data
+
+
+class AgentError(exceptions.ArgusError):
+    """The agent died or it couldn't be started."""
+
+
+class AgentUnavailableError(AgentError):
+    """The agent couldn't be started, so the request wasn't sent."""
+
+
+class PowerShellAgent(object):
+    """A persistent PowerShell process, running in the instance.
+
+    :param protocol_factory:
+        A callable which returns a new :class:`winrm.protocol.Protocol`.
+        The agent uses a shell of its own.
+    """
+
+    def __init__(self, protocol_factory):
+        self._protocol_factory = protocol_factory
+        self._protocol = None
+        self._shell_id = None
+        self._command_id = None
+        self._marker = batch.new_marker()
+        self._buffer = ""
+        self._ids = itertools.count()
+        self.lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._command_id is not None
+
+    def _send(self, data, end=False):
+        self._protocol.send_command_input(
+            self._shell_id, self._command_id, data, end=end)
+
+    def _read_line(self):
+        """Read the next line written by the agent, prefixed by the marker."""
+        prefix = self._marker + " "
+        while True:
+            lines = self._buffer.split("\n")
+            self._buffer = lines.pop()
+            for index, line in enumerate(lines):
+                if line.startswith(prefix):
+                    self._buffer = "\n".join(lines[index + 1:] +
+                                             [self._buffer])
+                    return line[len(prefix):].strip()
+
+            output = streaming.get_output(self._protocol, self._shell_id,
+                                          self._command_id)
+            if output is None:
+                continue
+            stdout, _, exit_code, done = output
+            self._buffer += _to_text(stdout)
+            if done:
+                self.stop()
+                raise AgentError("The PowerShell agent exited with code "
+                                 "{}.".format(exit_code))
+
+    def start(self):
+        """Start the agent and wait for it to be ready."""
+        script = _AGENT_SCRIPT.format(marker=self._marker,
+                                      runner=batch.POWERSHELL_RUNNER)
+        self._protocol = self._protocol_factory()
+        self._shell_id = self._protocol.open_shell()
+        self._command_id = self._protocol.run_command(
+            self._shell_id, util.get_command(script, util.POWERSHELL),
+            console_mode_stdin=False)
+        try:
+            ready = self._read_line() == "ready"
+        except AgentError as exc:
+            raise AgentUnavailableError(
+                "The PowerShell agent failed to start: {}".format(exc))
+        if not ready:
+            self.stop()
+            raise AgentUnavailableError(
+                "The PowerShell agent failed to start.")
+        LOG.debug("The PowerShell agent is ready.")
+
+    def stop(self):
+        """Stop the agent, ignoring the errors of a dead one."""
+        if self._shell_id is None:
+            return
+        try:
+            if self._command_id is not None:
+                self._send(b'', end=True)
+                self._protocol.cleanup_command(self._shell_id,
+                                               self._command_id)
+            self._protocol.close_shell(self._shell_id)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.debug("Stopping the PowerShell agent failed with %r.", exc)
+        finally:
+            self._shell_id = self._command_id = None
+            self._buffer = ""
+
+    def execute(self, script):
+        """Execute the given PowerShell script in the agent's runspace.
+
+        Only :class:`AgentUnavailableError` tells that the script
+        wasn't sent to the agent. After it was sent, the script is
+        never executed again, the errors are raised instead.
+
+        :rtype: tuple
+        :returns: stdout, stderr, exit_code
+        """
+        if not self.running:
+            self.start()
+
+        request_id = next(self._ids)
+        request = json.dumps({"id": request_id, "script": script})
+        try:
+            self._send((request + "\r\n").encode("ascii"))
+            while True:
+                response = json.loads(self._read_line())
+                if response["id"] == request_id:
+                    break
+        except AgentError:
+            raise
+        except Exception:
+            # The state of the agent is unknown, start a new one
+            # for the next request.
+            self.stop()
+            raise
+        return (response["stdout"], response["stderr"],
+                response["exit_code"])
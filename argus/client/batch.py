@@ -0,0 +1,149 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Pack multiple commands in a single remote PowerShell invocation.
+
+Every command of a batch is executed by a small PowerShell dispatcher,
+which captures its output and its exit code, then writes a single
+result line, prefixed by an unique marker::
+
+    <marker> <index> <exit code> <base64 stdout> <base64 stderr>
+
+PowerShell commands are executed in the dispatcher's process, as
+script blocks, while the other command types are executed through
+``cmd.exe``. Since PowerShell commands share the dispatcher's process,
+they must not call ``exit``.
+"""
+
+import base64
+import binascii
+import os
+
+import six
+
+from argus import exceptions
+from argus import util
+
+
+# The maximum length of a command line accepted by cmd.exe.
+MAX_COMMAND_LENGTH = 8191
+
+# Run the PowerShell script from $c, setting its output in $o and $e
+# and its exit code in $x. Like for powershell.exe, the exit code is
+# the one of the last failed native command, while what the native
+# commands write to their standard error doesn't fail the script.
+POWERSHELL_RUNNER = r"""$global:LASTEXITCODE=0
+$r=@(&([scriptblock]::Create($c)) 2>&1)
+$t=[Management.Automation.ErrorRecord]
+$o=$r|?{$_ -isnot $t}|Out-String;$f=@($r|?{$_ -is $t});$e=$f|Out-String
+if($global:LASTEXITCODE){$x=$global:LASTEXITCODE}
+elseif($f|?{$_.FullyQualifiedErrorId -notlike 'NativeCommandError*'}){$x=1}"""
+
+# The dispatcher is kept terse, since it is sent along every batch.
+_PRELUDE = r"""$ErrorActionPreference='Continue'
+$m='{marker}';$u=New-Object Text.UTF8Encoding $false
+function ArgusRun($i,$k,$c){{$o='';$e='';$x=0
+try{{$c=$u.GetString([Convert]::FromBase64String($c))
+if($k -eq 'powershell'){{{runner}}}
+else{{$s=New-Object Diagnostics.ProcessStartInfo 'cmd.exe',"/c $c"
+$s.UseShellExecute=$false;$s.RedirectStandardOutput=$true
+$s.RedirectStandardError=$true;$p=[Diagnostics.Process]::Start($s)
+$a=$p.StandardError.ReadToEndAsync();$o=$p.StandardOutput.ReadToEnd()
+$p.WaitForExit();$e=$a.Result;$x=$p.ExitCode}}}}
+catch{{$e=$_|Out-String;$x=1}}
+'{{0}} {{1}} {{2}} {{3}} {{4}}' -f $m,$i,$x,
+[Convert]::ToBase64String($u.GetBytes([string]$o)),
+[Convert]::ToBase64String($u.GetBytes([string]$e))}}
+"""
+_INVOKE = "ArgusRun {index} '{kind}' '{encoded}'\n"
+
+
+def _decode(data):
+    decoded = base64.b64decode(data)
+    if six.PY3:
+        decoded = decoded.decode("utf-8")
+    return decoded
+
+
+def new_marker():
+    """Get an unique marker for delimiting the results of a batch."""
+    return "ARGUS-{}".format(binascii.hexlify(os.urandom(8)).decode())
+
+
+def _invocation(index, command, command_type):
+    if command_type == util.POWERSHELL:
+        kind = util.POWERSHELL
+    else:
+        # Anything else is a command line, which is run through cmd.exe.
+        kind = util.CMD
+        command = util.get_command(command, command_type)
+    return _INVOKE.format(index=index, kind=kind,
+                          encoded=util.b64encode(command))
+
+
+def build_scripts(commands, marker, max_length=MAX_COMMAND_LENGTH):
+    """Build the PowerShell scripts which will execute the given commands.
+
+    :param commands:
+        A list of tuples of two elements, the command and its type.
+    :param marker:
+        The marker used for delimiting the results.
+    :param max_length:
+        The commands are split in as many scripts as needed, in order
+        for each encoded script to have at most this length. A command
+        which doesn't fit anyway gets a script of its own.
+    :rtype: list
+    """
+    prelude = _PRELUDE.format(marker=marker,
+                              runner=POWERSHELL_RUNNER)
+    scripts = []
+    current = prelude
+    for index, (command, command_type) in enumerate(commands):
+        invocation = _invocation(index, command, command_type)
+        candidate = current + invocation
+        encoded = util.get_command(candidate, util.POWERSHELL)
+        if current != prelude and len(encoded) > max_length:
+            scripts.append(current)
+            candidate = prelude + invocation
+        current = candidate
+    if current != prelude:
+        scripts.append(current)
+    return scripts
+
+
+def parse_results(output, marker, count):
+    """Get the results of a batch from the output of its scripts.
+
+    :param output: The concatenated standard output of the scripts.
+    :param marker: The marker used for delimiting the results.
+    :param count: The number of commands from the batch.
+    :returns:
+        A list with a tuple of stdout, stderr and exit code
+        for each command.
+    """
+    results = {}
+    for line in output.splitlines():
+        if not line.startswith(marker + " "):
+            continue
+        _, index, exit_code, stdout, stderr = line.rstrip("\r\n").split(" ")
+        results[int(index)] = (_decode(stdout), _decode(stderr),
+                               int(exit_code))
+
+    missing = sorted(set(range(count)) - set(results))
+    if missing:
+        raise exceptions.ArgusError(
+            "No result was received for the commands {!r} of the batch."
+            .format(missing))
+    return [results[index] for index in range(count)]
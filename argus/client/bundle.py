@@ -0,0 +1,184 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Ship the resources of argus to an instance in a single archive.
+
+The Windows resources are packed on the host into a zip archive,
+which is uploaded and extracted under :data:`RESOURCES_DIR` with
+a couple of commands, instead of downloading each resource from
+the instance. The archive holds a manifest with the SHA-256 digests
+of the resources, which is extracted last. The resources which are
+already in the instance with the same digest are left out of the
+next archives, so pushing the bundle again is cheap.
+
+Note that the bundled resources are the ones of the running argus,
+not the ones found at the ``resources`` URL from the configuration.
+"""
+
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+from argus import resources as argus_resources
+from argus import util
+
+
+LOG = util.get_logger()
+
+RESOURCES_DIR = r"C:\argus\resources"
+MANIFEST = "manifest.json"
+# The directories of :mod:`argus.resources` which are bundled.
+BUNDLED = ("windows", )
+
+_SKIPPED = ("__init__.py", )
+
+_MANIFEST_SCRIPT = (
+    "if(Test-Path -LiteralPath '{path}'){{"
+    "[IO.File]::ReadAllText('{path}')}}")
+_EXTRACT_SCRIPT = r"""$ErrorActionPreference='Stop'
+Add-Type -AssemblyName System.IO.Compression.FileSystem
+$z=[IO.Compression.ZipFile]::OpenRead('{archive}')
+try{{foreach($e in $z.Entries){{
+$t=Join-Path '{directory}' $e.FullName.Replace('/','\')
+New-Item -ItemType Directory -Force -Path (Split-Path $t) | Out-Null
+[IO.Compression.ZipFileExtensions]::ExtractToFile($e,$t,$true)}}}}
+finally{{$z.Dispose()}}
+Remove-Item -LiteralPath '{archive}'
+"""
+_COPY_SCRIPT = ("Copy-Item -LiteralPath '{source}' "
+                "-Destination '{destination}' -Force")
+
+
+def _resources_root():
+    return os.path.dirname(os.path.abspath(argus_resources.__file__))
+
+
+def local_resources():
+    """Get the bundled resources, with their local paths.
+
+    :returns:
+        A dictionary from the locations of the resources, relative
+        to :mod:`argus.resources`, to their paths on the host.
+    """
+    root = _resources_root()
+    found = {}
+    for directory in BUNDLED:
+        for dirpath, dirnames, filenames in os.walk(
+                os.path.join(root, directory)):
+            dirnames[:] = [name for name in dirnames
+                           if name != "__pycache__"]
+            for filename in filenames:
+                if filename in _SKIPPED or filename.endswith(".pyc"):
+                    continue
+                path = os.path.join(dirpath, filename)
+                location = os.path.relpath(path, root).replace(os.sep, "/")
+                found[location] = path
+    return found
+
+
+def _digest(path):
+    with open(path, "rb") as stream:
+        return hashlib.sha256(stream.read()).hexdigest()
+
+
+def build_manifest(resources):
+    """Get the SHA-256 digest of each of the given resources."""
+    return {location: _digest(path)
+            for location, path in resources.items()}
+
+
+def pack(resources, manifest, locations):
+    """Pack the given resources in a zip archive.
+
+    :param resources: The local paths of the resources.
+    :param manifest: The manifest, which is packed last.
+    :param locations: The locations of the packed resources.
+    :returns: A binary file object with the archive.
+    """
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for location in sorted(locations):
+            bundle.write(resources[location], location)
+        bundle.writestr(MANIFEST, json.dumps(manifest, sort_keys=True))
+    archive.seek(0)
+    return archive
+
+
+class ResourceBundle(object):
+    """The resources of argus, extracted in an instance.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` used
+        for pushing the bundle.
+    :param directory: The directory of the resources, in the instance.
+    """
+
+    def __init__(self, client, directory=RESOURCES_DIR):
+        self._client = client
+        self._directory = directory
+        self._manifest = None
+
+    def _remote_path(self, location):
+        return "{}\\{}".format(self._directory, location.replace("/", "\\"))
+
+    def _remote_manifest(self):
+        stdout, _, _ = self._client.run_remote_cmd(
+            _MANIFEST_SCRIPT.format(path=self._remote_path(MANIFEST)),
+            command_type=util.POWERSHELL)
+        try:
+            return json.loads(stdout.strip() or "{}")
+        except ValueError:
+            LOG.debug("The manifest of the resources is corrupted.")
+            return {}
+
+    def push(self):
+        """Push the resources which aren't in the instance yet.
+
+        :returns: The number of resources which were pushed.
+        """
+        resources = local_resources()
+        manifest = build_manifest(resources)
+        present = self._remote_manifest()
+        missing = [location for location, digest in manifest.items()
+                   if present.get(location) != digest]
+        if missing:
+            archive = pack(resources, manifest, missing)
+            remote_archive = self._remote_path(
+                "bundle-{}.zip".format(util.rand_name()))
+            self._client.run_remote_cmd(
+                "New-Item -ItemType Directory -Force -Path '{}' | Out-Null"
+                .format(self._directory), command_type=util.POWERSHELL)
+            self._client.upload_file(archive, remote_archive)
+            self._client.run_command_with_retry(
+                _EXTRACT_SCRIPT.format(archive=remote_archive,
+                                       directory=self._directory),
+                command_type=util.POWERSHELL)
+        LOG.info("Pushed %d resources to %s, %d were already there.",
+                 len(missing), self._directory,
+                 len(manifest) - len(missing))
+        self._manifest = manifest
+        return len(missing)
+
+    def __contains__(self, location):
+        return self._manifest is not None and location in self._manifest
+
+    def copy(self, location, destination):
+        """Copy a bundled resource to the given path, in the instance."""
+        self._client.run_command_with_retry(
+            _COPY_SCRIPT.format(source=self._remote_path(location),
+                                destination=destination),
+            command_type=util.POWERSHELL)
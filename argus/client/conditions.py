@@ -0,0 +1,138 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Conditions on the output of a command, which can be polled in the guest.
+
+A condition is a callable receiving the standard output of a command,
+so it can be used wherever a plain callable is expected, but it can
+also be translated to a PowerShell predicate. This lets the polling
+loop run inside the instance, in a single remote command, instead of
+doing a round trip for each check.
+"""
+
+import re
+
+from argus import util
+
+
+# The number of milliseconds between two checks done in the guest.
+POLL_INTERVAL = 500
+# The number of seconds a single guest loop polls for, when
+# the caller doesn't have a time limit.
+POLL_TIMEOUT = util.RETRY_COUNT * util.RETRY_DELAY
+
+# The probe's output is available in the predicate as `$o`.
+_POLL_SCRIPT = r"""$c=[Text.Encoding]::UTF8.GetString(
+[Convert]::FromBase64String('{probe}'))
+$d=(Get-Date).AddSeconds({timeout});$r=$false
+while($true){{$o=''
+try{{if('{kind}' -eq 'powershell'){{
+$o=&([scriptblock]::Create($c)) 2>$null|Out-String}}
+else{{$s=New-Object Diagnostics.ProcessStartInfo 'cmd.exe',"/c $c"
+$s.UseShellExecute=$false;$s.RedirectStandardOutput=$true
+$p=[Diagnostics.Process]::Start($s);$o=$p.StandardOutput.ReadToEnd()
+$p.WaitForExit()}}}}catch{{}}
+if({predicate}){{$r=$true;break}}
+if((Get-Date) -gt $d){{break}}
+Start-Sleep -Milliseconds {interval}}}
+[string]$r
+"""
+
+
+def _quote(value):
+    """Quote the given value as a PowerShell string literal."""
+    return "'{}'".format(value.replace("'", "''"))
+
+
+class Condition(object):
+    """A condition on the output of a command."""
+
+    def __call__(self, stdout):
+        raise NotImplementedError
+
+    def predicate(self):
+        """Get the PowerShell expression of this condition, over `$o`."""
+        raise NotImplementedError
+
+    def poll_script(self, command, command_type, timeout,
+                    interval=POLL_INTERVAL):
+        """Get a script polling the given command until this condition.
+
+        The script writes ``True`` if the condition was met before
+        the given timeout, in seconds, and ``False`` otherwise.
+        """
+        kind = util.POWERSHELL
+        if command_type != util.POWERSHELL:
+            kind = util.CMD
+            command = util.get_command(command, command_type)
+        return _POLL_SCRIPT.format(probe=util.b64encode(command), kind=kind,
+                                   timeout=int(timeout),
+                                   predicate=self.predicate(),
+                                   interval=int(interval))
+
+
+class Equals(Condition):
+    """The stripped output is equal to the given value."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, stdout):
+        return stdout.strip() == self.value
+
+    def predicate(self):
+        return "$o.Trim() -ceq {}".format(_quote(self.value))
+
+
+class Contains(Condition):
+    """The output contains the given value."""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, stdout):
+        return self.value in stdout
+
+    def predicate(self):
+        return "$o.Contains({})".format(_quote(self.value))
+
+
+class Matches(Condition):
+    """The output matches the given regular expression.
+
+    The pattern should use only the syntax which is common to
+    the Python and the .NET regular expressions.
+    """
+
+    def __init__(self, pattern):
+        self.pattern = pattern
+
+    def __call__(self, stdout):
+        return re.search(self.pattern, stdout) is not None
+
+    def predicate(self):
+        return "[regex]::IsMatch($o,{})".format(_quote(self.pattern))
+
+
+class PathExists(Equals):
+    """The given path exists in the instance.
+
+    The condition comes with its own probe, in :attr:`command`.
+    """
+
+    def __init__(self, path):
+        super(PathExists, self).__init__("True")
+        self.path = path
+        self.command = "Test-Path -Path {}".format(_quote(path))
@@ -0,0 +1,160 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Reuse the WinRM protocols and their HTTP connections.
+
+Every WinRM request used to go through a new protocol object, with
+a new HTTP session, so a new TCP connection and, for ``https``, a new
+TLS handshake were made for each batch of commands. A
+:class:`ConnectionCache` keeps a protocol object for each timeout,
+all of them sharing a single keep-alive session, which is itself
+shared by all the clients with the same endpoint and credentials.
+"""
+
+import hashlib
+import threading
+
+from winrm import protocol
+
+from argus import util
+
+
+LOG = util.get_logger()
+
+# The operation timeout, in seconds, used with the pywinrm versions
+# which have a class level default timeout.
+LEGACY_TIMEOUT = 3600
+# The HTTP read timeout has to exceed the operation timeout,
+# since the server can block for that long.
+READ_TIMEOUT_MARGIN = 10
+
+# The keep-alive HTTP sessions, keyed by the endpoint and the credentials.
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _session_key(endpoint, username, password, cert_pem, cert_key):
+    secret = hashlib.sha256(
+        u"\0".join([password or u"", cert_pem or u"", cert_key or u""])
+        .encode("utf-8")).hexdigest()
+    return endpoint, username, secret
+
+
+def _pool_counters(session):
+    """Get the number of requests and connections made by the session."""
+    requests_count = connections = 0
+    for adapter in session.adapters.values():
+        pools = getattr(getattr(adapter, "poolmanager", None), "pools", None)
+        if pools is None:
+            continue
+        for key in pools.keys():
+            pool = pools[key]
+            requests_count += getattr(pool, "num_requests", 0)
+            connections += getattr(pool, "num_connections", 0)
+    return requests_count, connections
+
+
+class ConnectionCache(object):
+    """Keep the WinRM protocols of a client, sharing their connections.
+
+    :param endpoint: The WS-Management endpoint.
+    :param username: The username of the client.
+    :param password: The password of the client.
+    :param cert_pem:
+        Client authentication certificate file path in PEM format.
+    :param cert_key:
+        Client authentication certificate key file path in PEM format.
+    """
+
+    def __init__(self, endpoint, username, password, cert_pem=None,
+                 cert_key=None):
+        self._endpoint = endpoint
+        self._username = username
+        self._password = password
+        self._cert_pem = cert_pem
+        self._cert_key = cert_key
+        self._key = _session_key(endpoint, username, password,
+                                 cert_pem, cert_key)
+        self._protocols = {}
+        self._lock = threading.Lock()
+
+    def _new_protocol(self, timeout):
+        kwargs = {}
+        legacy = hasattr(protocol.Protocol, "DEFAULT_TIMEOUT")
+        if timeout and not legacy:
+            kwargs = {"operation_timeout_sec": timeout,
+                      "read_timeout_sec": timeout + READ_TIMEOUT_MARGIN}
+
+        protocol_client = protocol.Protocol(endpoint=self._endpoint,
+                                            transport='plaintext',
+                                            username=self._username,
+                                            password=self._password,
+                                            cert_pem=self._cert_pem,
+                                            cert_key_pem=self._cert_key,
+                                            **kwargs)
+        if legacy:
+            # Set on the instance, not on the class, which would
+            # change the timeout of every other client as well.
+            protocol_client.timeout = "PT{}S".format(
+                timeout or LEGACY_TIMEOUT)
+
+        transport = protocol_client.transport
+        if hasattr(transport, "build_session"):
+            with _SESSIONS_LOCK:
+                session = _SESSIONS.get(self._key)
+                if session is None:
+                    session = _SESSIONS[self._key] = transport.build_session()
+            transport.session = session
+        return protocol_client
+
+    def protocol(self, timeout=None):
+        """Get the protocol for the given operation timeout, in seconds.
+
+        The default timeout is the one of the pywinrm library.
+        """
+        with self._lock:
+            protocol_client = self._protocols.get(timeout)
+            if protocol_client is None:
+                protocol_client = self._new_protocol(timeout)
+                self._protocols[timeout] = protocol_client
+        return protocol_client
+
+    @property
+    def stats(self):
+        """The number of protocols, HTTP requests and connections.
+
+        The requests and the connections are counted for the session
+        shared with the other clients of the same endpoint.
+        """
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.get(self._key)
+        requests_count, connections = (
+            _pool_counters(session) if session else (0, 0))
+        with self._lock:
+            protocols = len(self._protocols)
+        return {"protocols": protocols,
+                "requests": requests_count,
+                "connections": connections,
+                "reused": max(requests_count - connections, 0)}
+
+    def reset(self):
+        """Close the shared connections, for instance after a reboot."""
+        with _SESSIONS_LOCK:
+            session = _SESSIONS.pop(self._key, None)
+        with self._lock:
+            self._protocols.clear()
+        if session is not None:
+            session.close()
+            LOG.debug("Closed the connections to %s.", self._endpoint)
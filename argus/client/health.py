@@ -0,0 +1,202 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Track the health of the hosts and stop talking to the dead ones.
+
+Each host has a circuit breaker, shared by all its clients. After
+a number of consecutive transport failures, spanning more than
+a grace period, the circuit opens and every remote call fails
+immediately with :class:`argus.exceptions.ArgusCircuitOpenError`,
+instead of waiting for a connection timeout of its own. The retry
+loops don't retry this error, so a dead host costs a single timeout
+budget, instead of one for each call. The authentication errors
+don't count as failures, since they depend on the credentials of
+each client.
+
+While the circuit is open, the WinRM port of the host is probed in
+the background, and when it accepts connections again, a single call
+is let through, which closes the circuit if it succeeds.
+"""
+
+import contextlib
+import socket
+import threading
+import time
+
+from argus import exceptions
+from argus import retry
+from argus import util
+
+
+LOG = util.get_logger()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+# The number of consecutive transport failures which open the circuit.
+FAILURE_THRESHOLD = 3
+# The failures have to span at least this number of seconds, since
+# a booting instance is unreachable for a while.
+GRACE_PERIOD = util.RETRY_COUNT * util.RETRY_DELAY
+# The number of seconds between two probes of an open circuit.
+PROBE_INTERVAL = 10
+PROBE_TIMEOUT = 5
+
+_HOSTS = {}
+_HOSTS_LOCK = threading.Lock()
+
+
+def get_host_health(hostname, port):
+    """Get the health tracker of the given host."""
+    with _HOSTS_LOCK:
+        health = _HOSTS.get((hostname, port))
+        if health is None:
+            health = _HOSTS[(hostname, port)] = HostHealth(hostname, port)
+        return health
+
+
+class HostHealth(object):
+    """The circuit breaker of a host.
+
+    :param hostname: The address of the host.
+    :param port: The port probed while the circuit is open.
+    """
+
+    def __init__(self, hostname, port, threshold=FAILURE_THRESHOLD,
+                 grace_period=GRACE_PERIOD, probe_interval=PROBE_INTERVAL):
+        self.hostname = hostname
+        self.port = port
+        self._threshold = threshold
+        self._grace_period = grace_period
+        self._probe_interval = probe_interval
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._first_failure = None
+        self._cause = None
+        self._trial = False
+        self._probe = None
+        self._opened = 0
+
+    @property
+    def state(self):
+        return self._state
+
+    @property
+    def stats(self):
+        """The state, the consecutive failures and how many times
+        the circuit was opened."""
+        with self._lock:
+            return {"state": self._state, "failures": self._failures,
+                    "opened": self._opened}
+
+    def _probe_loop(self):
+        while True:
+            time.sleep(self._probe_interval)
+            with self._lock:
+                if self._state != OPEN:
+                    self._probe = None
+                    return
+            try:
+                socket.create_connection((self.hostname, self.port),
+                                         PROBE_TIMEOUT).close()
+            except (socket.error, socket.timeout):
+                continue
+            with self._lock:
+                if self._state == OPEN:
+                    LOG.info("Host %s is reachable again, trying a call.",
+                             self.hostname)
+                    self._state = HALF_OPEN
+                    self._trial = False
+                self._probe = None
+                return
+
+    def _open(self):
+        self._state = OPEN
+        self._opened += 1
+        LOG.warning("Host %s failed %d times in a row, failing the next "
+                    "calls early: %r", self.hostname, self._failures,
+                    self._cause)
+        if self._probe is None:
+            self._probe = threading.Thread(target=self._probe_loop)
+            self._probe.daemon = True
+            self._probe.start()
+
+    def check(self):
+        """Raise an error if the calls to the host should fail early."""
+        with self._lock:
+            if self._state == CLOSED:
+                return
+            if self._state == HALF_OPEN and not self._trial:
+                # Let a single call check the host.
+                self._trial = True
+                return
+            cause = self._cause
+        raise exceptions.ArgusCircuitOpenError(
+            "Host {} is unreachable, the last error was {!r}."
+            .format(self.hostname, cause), cause=cause)
+
+    def record_success(self):
+        with self._lock:
+            if self._state != CLOSED:
+                LOG.info("Host %s is healthy again.", self.hostname)
+            self._state = CLOSED
+            self._failures = 0
+            self._first_failure = None
+            self._cause = None
+
+    def record_failure(self, exc):
+        with self._lock:
+            now = time.time()
+            self._failures += 1
+            self._cause = exc
+            if self._first_failure is None:
+                self._first_failure = now
+            if self._state == HALF_OPEN:
+                self._open()
+            elif (self._state == CLOSED and
+                  self._failures >= self._threshold and
+                  now - self._first_failure >= self._grace_period):
+                self._open()
+
+    def reset(self):
+        """Forget the failures, for instance when a reboot is expected."""
+        with self._lock:
+            self._state = CLOSED
+            self._failures = 0
+            self._first_failure = None
+            self._cause = None
+
+    @contextlib.contextmanager
+    def guard(self):
+        """Check the circuit, then record the outcome of the block.
+
+        Only the transport errors count as failures, any other
+        outcome means that the host is reachable. This includes
+        the authentication errors, which depend on the credentials
+        of the client, not on the host.
+        """
+        self.check()
+        try:
+            yield
+        except retry.TRANSPORT_ERRORS as exc:
+            self.record_failure(exc)
+            raise
+        except Exception:
+            self.record_success()
+            raise
+        else:
+            self.record_success()
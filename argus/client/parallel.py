@@ -0,0 +1,121 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Run independent remote commands concurrently.
+
+Each method of :class:`AsyncWinRemoteClient` returns immediately with
+an :class:`multiprocessing.pool.AsyncResult`, whose ``get`` method
+waits for the result, raising the error of the call, if any::
+
+    with parallel.AsyncWinRemoteClient(client) as async_client:
+        results = [async_client.read_file(path) for path in paths]
+        contents = parallel.gather(results)
+
+The commands are executed over parallel shells of the wrapped client.
+The number of commands in flight for a host is bounded, no matter how
+many asynchronous clients are used for it.
+"""
+
+import functools
+import threading
+from multiprocessing import pool as thread_pool
+
+from argus import util
+
+
+LOG = util.get_logger()
+
+# The maximum number of commands in flight for a host.
+MAX_CONCURRENCY = 4
+
+_HOST_LIMITS = {}
+_HOST_LIMITS_LOCK = threading.Lock()
+
+
+def _host_limit(hostname, max_concurrency):
+    with _HOST_LIMITS_LOCK:
+        limit = _HOST_LIMITS.get(hostname)
+        if limit is None:
+            limit = threading.BoundedSemaphore(max_concurrency)
+            _HOST_LIMITS[hostname] = limit
+        return limit
+
+
+def gather(results, timeout=None):
+    """Wait for the given asynchronous results and return their values.
+
+    :param timeout: The number of seconds to wait for each result.
+    """
+    return [result.get(timeout) for result in results]
+
+
+class AsyncWinRemoteClient(object):
+    """A non-blocking wrapper over a :class:`WinRemoteClient`.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` which
+        executes the commands.
+    :param max_concurrency:
+        The maximum number of commands in flight for the client's host.
+        The first client of a host sets the limit.
+    """
+
+    def __init__(self, client, max_concurrency=MAX_CONCURRENCY):
+        self._client = client
+        self._limit = _host_limit(client.hostname, max_concurrency)
+        self._pool = thread_pool.ThreadPool(max_concurrency)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Wait for the pending calls, then stop the worker threads."""
+        self._pool.close()
+        self._pool.join()
+
+    def _limited(self, func, *args, **kwargs):
+        with self._limit:
+            return func(*args, **kwargs)
+
+    def submit(self, func, *args, **kwargs):
+        """Call the given function in a worker thread.
+
+        The function is expected to run commands through the client,
+        so it counts towards the limit of the client's host.
+        """
+        return self._pool.apply_async(
+            functools.partial(self._limited, func, *args, **kwargs))
+
+    def run_command(self, cmd, command_type=util.POWERSHELL):
+        return self.submit(self._client.run_command, cmd,
+                           command_type=command_type)
+
+    def run_command_verbose(self, cmd, command_type=util.POWERSHELL):
+        return self.submit(self._client.run_command_verbose, cmd,
+                           command_type=command_type)
+
+    def run_command_with_retry(self, cmd, *args, **kwargs):
+        return self.submit(self._client.run_command_with_retry, cmd,
+                           *args, **kwargs)
+
+    def copy_file(self, filepath, remote_destination):
+        return self.submit(self._client.copy_file, filepath,
+                           remote_destination)
+
+    def read_file(self, filepath):
+        return self.submit(self._client.read_file, filepath)
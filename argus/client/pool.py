@@ -0,0 +1,176 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A pool of long-lived WinRM shells, shared by the commands of a client."""
+
+import collections
+import contextlib
+import threading
+import time
+
+from argus import retry
+from argus import util
+
+
+LOG = util.get_logger()
+
+CODEPAGE_UTF8 = 65001
+# Number of idle shells kept open for a client.
+MAX_IDLE_SHELLS = 4
+# A shell which was idle for more than this number of seconds
+# is checked before being reused, since the instance might have
+# been rebooted in the meantime.
+HEALTH_CHECK_IDLE = 60
+
+
+class Shell(object):
+    """A remote shell, together with the protocol which opened it."""
+
+    def __init__(self, protocol_client, shell_id):
+        self.protocol = protocol_client
+        self.shell_id = shell_id
+        self.last_used = time.time()
+        self.closed = False
+
+    @property
+    def idle_time(self):
+        return time.time() - self.last_used
+
+    def close(self):
+        """Close the shell, ignoring the errors of an already dead one."""
+        self.closed = True
+        try:
+            self.protocol.close_shell(self.shell_id)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.debug("Closing shell %s failed with %r.", self.shell_id, exc)
+
+
+class ShellPool(object):
+    """Keep a number of WinRM shells open and reuse them.
+
+    :param protocol_factory:
+        A callable which returns a new :class:`winrm.protocol.Protocol`
+        whenever a new shell has to be opened.
+    :param max_idle:
+        The maximum number of idle shells which are kept open.
+    :param codepage:
+        The codepage used by the opened shells.
+    """
+
+    def __init__(self, protocol_factory, max_idle=MAX_IDLE_SHELLS,
+                 codepage=CODEPAGE_UTF8):
+        self._protocol_factory = protocol_factory
+        self._max_idle = max_idle
+        self._codepage = codepage
+        self._idle = []
+        self._lock = threading.Lock()
+        self._stats = collections.Counter()
+
+    @property
+    def stats(self):
+        """Return the hit, miss, rebuild and health check counters."""
+        with self._lock:
+            return {key: self._stats[key]
+                    for key in ("hits", "misses", "rebuilds",
+                                "health_checks")}
+
+    def _open(self):
+        protocol_client = self._protocol_factory()
+        shell_id = protocol_client.open_shell(codepage=self._codepage)
+        return Shell(protocol_client, shell_id)
+
+    @staticmethod
+    def _is_healthy(shell):
+        """Check that the shell is still known by the remote WinRM service."""
+        command_id = None
+        try:
+            command_id = shell.protocol.run_command(shell.shell_id, "rem")
+            shell.protocol.get_command_output(shell.shell_id, command_id)
+        except Exception as exc:  # pylint: disable=broad-except
+            LOG.debug("Shell %s failed the health check with %r.",
+                      shell.shell_id, exc)
+            return False
+        else:
+            shell.protocol.cleanup_command(shell.shell_id, command_id)
+        return True
+
+    def _checkout(self):
+        with self._lock:
+            shell = self._idle.pop() if self._idle else None
+            if shell is None:
+                self._stats["misses"] += 1
+
+        if shell is None:
+            return self._open()
+
+        if shell.idle_time > HEALTH_CHECK_IDLE:
+            with self._lock:
+                self._stats["health_checks"] += 1
+            if not self._is_healthy(shell):
+                shell.close()
+                with self._lock:
+                    self._stats["rebuilds"] += 1
+                return self._open()
+
+        with self._lock:
+            self._stats["hits"] += 1
+        return shell
+
+    def _checkin(self, shell):
+        if shell.closed:
+            return
+        shell.last_used = time.time()
+        with self._lock:
+            if len(self._idle) < self._max_idle:
+                self._idle.append(shell)
+                return
+        shell.close()
+
+    def discard(self, shell):
+        """Close the given shell, which will be rebuilt when needed."""
+        shell.close()
+        with self._lock:
+            self._stats["rebuilds"] += 1
+
+    @contextlib.contextmanager
+    def shell(self):
+        """Check out a shell from the pool.
+
+        The shell is given back to the pool when the block finishes.
+        If a transport or an authentication error occurs, the shell
+        is discarded instead and a new one will be opened for the
+        next request.
+        """
+        shell = self._checkout()
+        try:
+            yield shell
+        except retry.SESSION_ERRORS:
+            self.discard(shell)
+            raise
+        except Exception:
+            self._checkin(shell)
+            raise
+        else:
+            self._checkin(shell)
+
+    def invalidate(self):
+        """Drop all the idle shells, for instance after a reboot."""
+        with self._lock:
+            shells, self._idle = self._idle, []
+        for shell in shells:
+            shell.close()
+        LOG.debug("Invalidated %d idle shells.", len(shells))
+
+    close = invalidate
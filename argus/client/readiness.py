@@ -0,0 +1,160 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Check if an instance is ready, from the cheapest check to the costliest.
+
+The readiness of an instance is probed in layers, each of them being
+tried only when the previous one passed:
+
+* ``tcp``, the WinRM port accepts connections;
+* ``identify``, the WinRM service answers to an unauthenticated
+  WS-Management Identify request;
+* ``logon``, a trivial command can be executed with the credentials
+  of the client.
+
+This way, an instance which isn't even listening yet costs a TCP
+connection attempt, instead of a full WinRM command.
+"""
+
+import socket
+import time
+
+import requests
+
+from argus import exceptions
+from argus import retry
+from argus import util
+
+
+LOG = util.get_logger()
+
+TCP = "tcp"
+IDENTIFY = "identify"
+LOGON = "logon"
+LAYERS = (TCP, IDENTIFY, LOGON)
+
+# The number of seconds to wait for a single probe.
+TCP_TIMEOUT = 2
+IDENTIFY_TIMEOUT = 5
+LOGON_TIMEOUT = 30
+
+_IDENTIFY_REQUEST = (
+    b'<s:Envelope xmlns:s="http://www.w3.org/2003/05/soap-envelope" '
+    b'xmlns:wsmid="http://schemas.dmtf.org/wbem/wsman/identity/1/'
+    b'wsmanidentity.xsd"><s:Header/><s:Body><wsmid:Identify/>'
+    b'</s:Body></s:Envelope>')
+_IDENTIFY_HEADERS = {
+    "Content-Type": "application/soap+xml;charset=UTF-8",
+    "WSMANIDENTIFY": "unauthenticated",
+}
+
+
+def tcp_probe(hostname, port, timeout=TCP_TIMEOUT):
+    """Check if the given port accepts connections."""
+    try:
+        socket.create_connection((hostname, port), timeout).close()
+    except (socket.error, socket.timeout):
+        return False
+    return True
+
+
+def identify_probe(endpoint, timeout=IDENTIFY_TIMEOUT):
+    """Check if the WinRM service answers to an Identify request."""
+    try:
+        response = requests.post(endpoint, data=_IDENTIFY_REQUEST,
+                                 headers=_IDENTIFY_HEADERS,
+                                 timeout=timeout, verify=False)
+    except requests.RequestException:
+        return False
+    return b"IdentifyResponse" in response.content
+
+
+def logon_probe(client, timeout=LOGON_TIMEOUT):
+    """Check if a command can be executed with the client's credentials."""
+    try:
+        client.run_remote_cmd("rem", command_type=util.CMD,
+                              timeout=timeout)
+    except Exception as exc:  # pylint: disable=broad-except
+        LOG.debug("The logon check failed with %r.", exc)
+        return False
+    return True
+
+
+class ReadinessProbe(object):
+    """Probe the readiness of an instance, layer by layer.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` of the
+        instance, used for the logon check.
+    :param hostname: The address of the instance.
+    :param port: The WinRM port of the instance.
+    :param endpoint: The WS-Management endpoint of the instance.
+    """
+
+    def __init__(self, client, hostname, port, endpoint):
+        self._probes = {
+            TCP: lambda: tcp_probe(hostname, port),
+            IDENTIFY: lambda: identify_probe(endpoint),
+            LOGON: lambda: logon_probe(client),
+        }
+        self._started = None
+        # The latency of the probe which passed, for each layer.
+        self.latencies = {}
+        # The number of seconds since the start, when each
+        # layer passed for the first time.
+        self.reached = {}
+
+    def check(self):
+        """Probe all the layers, in order.
+
+        :returns: The first layer which failed, None if all passed.
+        """
+        if self._started is None:
+            self._started = time.time()
+        for layer in LAYERS:
+            started = time.time()
+            if not self._probes[layer]():
+                return layer
+            now = time.time()
+            self.latencies[layer] = now - started
+            self.reached.setdefault(layer, now - self._started)
+        return None
+
+    def wait(self, policy=None):
+        """Wait until all the layers pass.
+
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` of the checks.
+        :returns: The latencies of the layers.
+        """
+        policy = policy or retry.DEFAULT
+        state = policy.begin("the readiness of the instance")
+        while True:
+            failed = self.check()
+            if failed is None:
+                state.done()
+                break
+            LOG.debug("The instance isn't ready yet, the %s check failed.",
+                      failed)
+            if not state.wait():
+                raise exceptions.ArgusTimeoutError(
+                    "The instance isn't ready, the {} check failed."
+                    .format(failed))
+
+        for layer in LAYERS:
+            LOG.info("Readiness check %s passed after %.1f seconds, "
+                     "taking %.3f seconds.", layer, self.reached[layer],
+                     self.latencies[layer])
+        return dict(self.latencies)
@@ -0,0 +1,142 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Follow an instance through an expected reboot.
+
+A :class:`RebootWatcher` is started before the reboot is triggered.
+It probes the WinRM port of the instance in the background and goes
+through the following phases:
+
+* ``expected``, the instance is still up;
+* ``down``, the port is closed, so the reboot started;
+* ``up``, the port accepts connections again;
+* ``winrm``, the WinRM service answers to Identify requests;
+* ``ready``, a command can be executed with the client's credentials.
+
+Only the last phase uses WinRM commands, the others are detected
+with the cheap probes of :mod:`argus.client.readiness`. Callers block
+on :meth:`wait`, which returns as soon as the instance is ready.
+"""
+
+import threading
+import time
+
+from argus.client import readiness
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+EXPECTED = "expected"
+DOWN = "down"
+UP = "up"
+WINRM = "winrm"
+READY = "ready"
+
+# The number of seconds between two probes.
+PROBE_INTERVAL = 1
+# The number of seconds to wait for a reboot, by default.
+REBOOT_TIMEOUT = 20 * 60
+
+_BOOT_TIME_CMD = ("(Get-CimInstance Win32_OperatingSystem)"
+                  ".LastBootUpTime.ToString('o')")
+
+
+def get_boot_time(client):
+    """Get the time when the instance booted, None if it's unreachable."""
+    try:
+        stdout, _, _ = client.run_remote_cmd(
+            _BOOT_TIME_CMD, command_type=util.POWERSHELL,
+            timeout=readiness.LOGON_TIMEOUT)
+    except Exception as exc:  # pylint: disable=broad-except
+        LOG.debug("The boot time can't be retrieved yet: %r", exc)
+        return None
+    return stdout.strip()
+
+
+class RebootWatcher(object):
+    """Follow the phases of an expected reboot.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` of the
+        rebooting instance.
+    :param hostname: The address of the instance.
+    :param port: The WinRM port of the instance.
+    :param endpoint: The WS-Management endpoint of the instance.
+    """
+
+    def __init__(self, client, hostname, port, endpoint):
+        self._client = client
+        self._hostname = hostname
+        self._port = port
+        self._endpoint = endpoint
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self.phase = EXPECTED
+        self.transitions = [(EXPECTED, time.time())]
+        self._boot_time = get_boot_time(client)
+
+    def _set_phase(self, phase):
+        if phase == self.phase:
+            return
+        LOG.info("Instance %s is now %s, after %.1f seconds.",
+                 self._hostname, phase,
+                 time.time() - self.transitions[0][1])
+        self.phase = phase
+        self.transitions.append((phase, time.time()))
+
+    def _watch(self):
+        rebooting = False
+        while not self._stop.is_set():
+            if not readiness.tcp_probe(self._hostname, self._port):
+                rebooting = True
+                self._set_phase(DOWN)
+            elif rebooting:
+                self._set_phase(UP)
+                if readiness.identify_probe(self._endpoint):
+                    self._set_phase(WINRM)
+                    boot_time = get_boot_time(self._client)
+                    if boot_time is not None and (
+                            boot_time != self._boot_time or
+                            self._boot_time is None):
+                        self._set_phase(READY)
+                        self._ready.set()
+                        return
+            self._stop.wait(PROBE_INTERVAL)
+
+    def start(self):
+        """Start following the reboot, in the background."""
+        self._thread = threading.Thread(target=self._watch)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def wait(self, timeout=REBOOT_TIMEOUT):
+        """Wait for the instance to be ready after the reboot.
+
+        :raises:
+            :class:`argus.exceptions.ArgusTimeoutError` if the instance
+            isn't ready in the given number of seconds.
+        """
+        if not self._ready.wait(timeout):
+            self.stop()
+            raise exceptions.ArgusTimeoutError(
+                "Instance {} wasn't ready {} seconds after the reboot, "
+                "it is {}.".format(self._hostname, timeout, self.phase))
+        return self.transitions
@@ -0,0 +1,132 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Keep the PowerShell scripts used by the tests inside the instance.
+
+Each script is uploaded once, under :data:`SCRIPTS_DIR`, in a file
+named after the SHA-256 digest of its content. Later uses of the same
+script only invoke it by its path, even from other clients, since
+the file is looked up in the instance before uploading it.
+
+Since the files are moved into place only after their checksum was
+verified, a file with the name of a script always has its content.
+"""
+
+import codecs
+import hashlib
+import threading
+
+import six
+
+from argus.client import batch
+from argus import util
+
+
+LOG = util.get_logger()
+
+SCRIPTS_DIR = r"C:\argus\scripts"
+
+# Check if a script is already in the instance, creating
+# the directory of the scripts otherwise.
+_LOOKUP_SCRIPT = (
+    "if(Test-Path -LiteralPath '{path}'){{'True'}}else{{"
+    "New-Item -ItemType Directory -Force -Path '{directory}' | Out-Null;"
+    "'False'}}")
+
+
+def digest(script):
+    """Get the SHA-256 digest of the given script."""
+    if isinstance(script, six.text_type):
+        script = script.encode("utf-8")
+    return hashlib.sha256(script).hexdigest()
+
+
+def is_too_long(command, command_type=util.POWERSHELL):
+    """Check if the given command doesn't fit on a command line."""
+    return (command_type == util.POWERSHELL and
+            len(util.get_command(command, command_type)) >
+            batch.MAX_COMMAND_LENGTH)
+
+
+class ScriptCache(object):
+    """The scripts uploaded in an instance.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` used
+        for uploading the scripts.
+    :param directory: The directory of the scripts, in the instance.
+    """
+
+    def __init__(self, client, directory=SCRIPTS_DIR):
+        self._client = client
+        self._directory = directory
+        self._lock = threading.Lock()
+        self._known = set()
+        self._hits = 0
+        self._uploads = 0
+        self._spilled = 0
+
+    @property
+    def stats(self):
+        """How many scripts were found, uploaded and spilled."""
+        return {"hits": self._hits, "uploads": self._uploads,
+                "spilled": self._spilled}
+
+    def forget(self):
+        """Look up the scripts in the instance again, on their next use."""
+        with self._lock:
+            self._known.clear()
+
+    def path(self, script):
+        """Get the path of the given script, uploading it if needed."""
+        name = digest(script)
+        path = "{}\\{}.ps1".format(self._directory, name)
+        with self._lock:
+            if name in self._known:
+                self._hits += 1
+                return path
+
+        stdout, _, _ = self._client.run_remote_cmd(
+            _LOOKUP_SCRIPT.format(path=path, directory=self._directory),
+            command_type=util.POWERSHELL)
+        if stdout.strip() == "True":
+            LOG.debug("Script %s is already in the instance.", name)
+            self._hits += 1
+        else:
+            if isinstance(script, six.text_type):
+                script = script.encode("utf-8")
+            # Without the BOM, Windows PowerShell reads
+            # the scripts in the ANSI code page.
+            self._client.write_file(codecs.BOM_UTF8 + script, path)
+            self._uploads += 1
+
+        with self._lock:
+            self._known.add(name)
+        return path
+
+    def spill(self, command, command_type=util.POWERSHELL):
+        """Move the given command into a script, if it's too long.
+
+        :returns:
+            A tuple of the command and its type, which are
+            the given ones if the command fits on a command line.
+        """
+        if not is_too_long(command, command_type):
+            return command, command_type
+        LOG.debug("Running a command of %d characters from a script.",
+                  len(command))
+        path = self.path(command)
+        self._spilled += 1
+        return path, util.POWERSHELL_SCRIPT_BYPASS
@@ -0,0 +1,185 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Deliver the output of a remote command while it is still running.
+
+The output is received chunk by chunk, as the WinRM receive responses
+arrive, and fed to an :class:`OutputSink`, which can pass each line
+to a callback, keep the output in a file which spills to disk and
+stop the command when a given pattern appears.
+"""
+
+import codecs
+import io
+import re
+import tempfile
+import time
+
+from winrm import exceptions as winrm_exceptions
+
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+STDOUT = "stdout"
+STDERR = "stderr"
+
+# Raised when the command didn't write anything during
+# the operation timeout, so the output is requested again.
+OPERATION_TIMEOUT = getattr(winrm_exceptions, "WinRMOperationTimeoutError",
+                            ())
+
+
+def get_output(protocol_client, shell_id, command_id):
+    """Get the output which the command wrote since the last request.
+
+    :returns:
+        A tuple of stdout, stderr, exit code and whether the command
+        is done, or None if the command didn't write anything
+        during the operation timeout.
+    """
+    try:
+        # pylint: disable=protected-access; pywinrm has no public method
+        # for getting the output of a command without waiting for it
+        # to finish.
+        return protocol_client._raw_get_command_output(shell_id, command_id)
+    except OPERATION_TIMEOUT:
+        return None
+
+
+def receive(protocol_client, shell_id, command_id, deadline=None):
+    """Yield the output of the given command, as it arrives.
+
+    :param deadline:
+        The time, as given by :func:`time.time`, after which
+        :class:`argus.exceptions.ArgusCommandTimeout` is raised
+        if the command is still running.
+    :returns:
+        A generator of tuples of stdout, stderr, exit code and
+        whether the command is done, the last one being done.
+    """
+    while True:
+        output = get_output(protocol_client, shell_id, command_id)
+        if output is not None:
+            yield output
+            if output[3]:
+                return
+        if deadline is not None and time.time() > deadline:
+            raise exceptions.ArgusCommandTimeout(
+                "Command {!r} is still running after its deadline."
+                .format(command_id), command=command_id)
+
+
+class StreamResult(object):
+    """The output of a streamed command.
+
+    :param stdout_file: The file with the standard output, as bytes.
+    :param stderr_file: The file with the standard error, as bytes.
+    :param exit_code:
+        The exit code of the command, None if it was stopped.
+    :param stopped:
+        True if the command was stopped, since the stop pattern
+        appeared in its output.
+    """
+
+    def __init__(self, stdout_file, stderr_file, exit_code, stopped):
+        self.stdout_file = stdout_file
+        self.stderr_file = stderr_file
+        self.exit_code = exit_code
+        self.stopped = stopped
+
+    @staticmethod
+    def _read(stream):
+        stream.seek(0)
+        return stream.read().decode("utf-8", "replace")
+
+    @property
+    def stdout(self):
+        """The whole standard output, loaded in memory."""
+        return self._read(self.stdout_file)
+
+    @property
+    def stderr(self):
+        """The whole standard error, loaded in memory."""
+        return self._read(self.stderr_file)
+
+
+class OutputSink(object):
+    """Collect the output of a command.
+
+    :param on_line:
+        A callable receiving each line of the output, as soon as
+        it is complete, for both the standard output and error.
+    :param spool_size:
+        When given, the output is kept in memory up to this number
+        of bytes for each stream, then spilled to a temporary file.
+    :param stop_pattern:
+        A regular expression which stops the command when a line
+        of its output matches it.
+    """
+
+    def __init__(self, on_line=None, spool_size=None, stop_pattern=None):
+        self._on_line = on_line
+        self._stop_pattern = (re.compile(stop_pattern)
+                              if stop_pattern else None)
+        self._files = {}
+        self._decoders = {}
+        self._partial = {}
+        for name in (STDOUT, STDERR):
+            if spool_size is None:
+                self._files[name] = io.BytesIO()
+            else:
+                self._files[name] = tempfile.SpooledTemporaryFile(
+                    max_size=spool_size)
+            self._decoders[name] = codecs.getincrementaldecoder("utf-8")(
+                "replace")
+            self._partial[name] = u""
+        self.stopped = False
+
+    def _lines(self, name, data, final=False):
+        text = self._partial[name] + self._decoders[name].decode(data, final)
+        lines = text.split(u"\n")
+        self._partial[name] = u"" if final else lines.pop()
+        return [line.rstrip(u"\r") for line in lines]
+
+    def feed(self, name, data, final=False):
+        """Add a chunk of the given stream.
+
+        :returns: True if the stop pattern appeared.
+        """
+        self._files[name].write(data)
+        if not (self._on_line or self._stop_pattern):
+            return False
+
+        for line in self._lines(name, data, final):
+            if final and not line:
+                continue
+            if self._on_line:
+                self._on_line(line)
+            if self._stop_pattern and self._stop_pattern.search(line):
+                LOG.debug("The output matched %r, stopping the command.",
+                          self._stop_pattern.pattern)
+                self.stopped = True
+        return self.stopped
+
+    def result(self, exit_code):
+        """Flush the incomplete lines and get the result of the command."""
+        for name in (STDOUT, STDERR):
+            self.feed(name, b"", final=True)
+        return StreamResult(self._files[STDOUT], self._files[STDERR],
+                            None if self.stopped else exit_code,
+                            self.stopped)
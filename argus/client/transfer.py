@@ -0,0 +1,399 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Binary safe file transfers between the host and a Windows instance.
+
+Uploaded data is written into a partial file next to the destination,
+at explicit offsets, so an interrupted upload can be resumed from
+what already reached the instance. The partial file is moved into
+place only after its SHA-256 checksum was verified.
+
+Downloaded data is read in chunks at explicit offsets and every chunk
+is written to the local file as soon as it arrives, so the memory
+used on the host is bounded by the size of a chunk.
+"""
+
+import base64
+import collections
+import hashlib
+import time
+import zlib
+
+import six
+
+from argus.client import batch
+from argus import exceptions
+from argus import retry
+from argus import util
+
+
+LOG = util.get_logger()
+
+# Size of the chunks read from a remote file with a single command.
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Size of the chunks written through the standard input of a
+# single remote command. It has to fit, after being encoded twice
+# in base64, by argus and by WinRM, into the default maximum
+# envelope size of the WinRM service, which is 150 KB on older
+# Windows versions.
+STREAM_CHUNK_SIZE = 64 * 1024
+PART_SUFFIX = ".argus-part"
+
+TransferStats = collections.namedtuple(
+    "TransferStats", "size transferred elapsed chunks resumed_from")
+
+_STREAM_SCRIPT = r"""$ErrorActionPreference='Stop'
+$f=[IO.File]::Open('{part}','OpenOrCreate','Write')
+$f.SetLength({offset});$f.Position={offset}
+try{{while($l=[Console]::In.ReadLine()){{
+$d=[Convert]::FromBase64String($l.Substring(1))
+if($l[0] -eq 'z'){{$z=New-Object IO.Compression.GZipStream(
+(New-Object IO.MemoryStream(,$d)),[IO.Compression.CompressionMode]::Decompress)
+$b=New-Object IO.MemoryStream;$z.CopyTo($b);$d=$b.ToArray()}}
+$f.Write($d,0,$d.Length)}}}}finally{{$f.Close()}}
+"""
+_CHUNK_COMMAND = (
+    "powershell -NoProfile -NonInteractive -Command \""
+    "$d=[Convert]::FromBase64String('{data}');{unpack}"
+    "$f=[IO.File]::Open('{part}','OpenOrCreate','Write');"
+    "$f.SetLength({offset});$f.Position={offset};"
+    "$f.Write($d,0,$d.Length);$f.Close()\"")
+_CHUNK_UNPACK = (
+    "$z=New-Object IO.Compression.GZipStream((New-Object IO.MemoryStream"
+    "(,$d)),[IO.Compression.CompressionMode]::Decompress);"
+    "$b=New-Object IO.MemoryStream;$z.CopyTo($b);$d=$b.ToArray();")
+# Output the size and the SHA-256 checksum of a file, taken from the
+# same read, so that they match even if the file grows meanwhile.
+_HASH_SCRIPT = (
+    "$s=[IO.File]::Open('{path}','Open','Read','ReadWrite');try{{"
+    "$h=[Security.Cryptography.SHA256]::Create();$b=New-Object byte[] 65536;"
+    "$n=$s.Length;$l=$n;while($l -gt 0){{"
+    "$r=$s.Read($b,0,[Math]::Min($l,$b.Length));if(!$r){{break}};"
+    "[void]$h.TransformBlock($b,0,$r,$null,0);$l-=$r}};"
+    "[void]$h.TransformFinalBlock($b,0,0);$n-$l;"
+    "[BitConverter]::ToString($h.Hash).Replace('-','')"
+    "}}finally{{$s.Close()}}")
+_PART_STATE_SCRIPT = (
+    "if(Test-Path -LiteralPath '{path}'){{" + _HASH_SCRIPT + "}}"
+    "else{{0}}")
+_INFO_SCRIPT = "$ErrorActionPreference='Stop';" + _HASH_SCRIPT
+_READ_SCRIPT = r"""$s=[IO.File]::Open('{path}','Open','Read','ReadWrite')
+try{{$s.Position={offset};$b=New-Object byte[] {size};$n=0
+while($n -lt {size}){{$r=$s.Read($b,$n,{size}-$n);if(!$r){{break}};$n+=$r}}
+}}finally{{$s.Close()}}
+$k='r';if({compress}){{$m=New-Object IO.MemoryStream
+$z=New-Object IO.Compression.GZipStream($m,
+[IO.Compression.CompressionMode]::Compress)
+$z.Write($b,0,$n);$z.Close();if($m.Length -lt $n){{
+$b=$m.ToArray();$n=$b.Length;$k='z'}}}}
+$k+[Convert]::ToBase64String($b,0,$n)
+"""
+_FINALIZE_SCRIPT = (
+    "$h=(&{{" + _HASH_SCRIPT + "}})[1]\n"
+    "if($h -ne '{digest}'){{Remove-Item -LiteralPath '{path}';"
+    "\"mismatch $h\"}}\n"
+    "else{{Move-Item -LiteralPath '{path}' -Destination '{destination}' "
+    "-Force}}")
+
+
+class ChecksumMismatchError(exceptions.ArgusError):
+    """The uploaded data was corrupted on its way to the instance."""
+
+
+def _quote(path):
+    """Quote a path for using it in a single quoted PowerShell string."""
+    return path.replace("'", "''")
+
+
+def _gzip(data):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _gunzip(data):
+    return zlib.decompress(data, 16 + zlib.MAX_WBITS)
+
+
+def _pack(data, compress):
+    """Compress the data, if it is worth it.
+
+    Return a tuple of two elements, a flag which tells if the data
+    was compressed and the data itself.
+    """
+    if compress:
+        packed = _gzip(data)
+        if len(packed) < len(data):
+            return True, packed
+    return False, data
+
+
+def _digest(stream, limit=None):
+    """Get the SHA-256 hex digest of the stream, from its beginning."""
+    stream.seek(0)
+    digest = hashlib.sha256()
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = STREAM_CHUNK_SIZE
+        if remaining is not None:
+            size = min(size, remaining)
+            remaining -= size
+        data = stream.read(size)
+        if not data:
+            break
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _non_empty(chunks):
+    """Yield the given chunks, or a single empty chunk if there are none."""
+    empty = True
+    for chunk in chunks:
+        empty = False
+        yield chunk
+    if empty:
+        yield b''
+
+
+def _command_chunk_size():
+    """The largest chunk which fits into a single command line."""
+    overhead = len(_CHUNK_COMMAND.format(
+        data="", unpack=_CHUNK_UNPACK, part="", offset=0)) + 512
+    return (batch.MAX_COMMAND_LENGTH - overhead) // 4 * 3
+
+
+class FileUploader(object):
+    """Upload files to a Windows instance.
+
+    When the underlying WinRM protocol can send input to a remote
+    command, the data is streamed in large chunks through the standard
+    input of a single command, which writes it into a `FileStream`.
+    Otherwise, every chunk is sent with a command of its own.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` used
+        for the transfer.
+    :param compress:
+        Compress the chunks with gzip, when it reduces their size.
+    :param retries:
+        How many times an interrupted upload is resumed.
+    """
+
+    def __init__(self, client, compress=False, retries=util.RETRY_COUNT):
+        self._client = client
+        self._compress = compress
+        self._policy = retry.RetryPolicy(max_attempts=retries + 1)
+
+    def _resume_offset(self, stream, size, part):
+        """Find out how much of the data was already uploaded."""
+        cmd = _PART_STATE_SCRIPT.format(path=_quote(part))
+        stdout, _, _ = self._client.run_remote_cmd(
+            cmd, command_type=util.POWERSHELL)
+        lines = stdout.split()
+        length = int(lines[0]) if lines else 0
+        if not length or length > size:
+            return 0
+        if lines[1].lower() != _digest(stream, limit=length):
+            LOG.debug("The partial upload %s is corrupted, restarting.", part)
+            return 0
+        return length
+
+    def _stream_chunks(self, stream, offset, size):
+        stream.seek(offset)
+        reader = lambda: stream.read(size)
+        for data in iter(reader, b''):
+            yield data
+
+    def _send_streamed(self, stream, part, offset):
+        sent = [0, 0]
+
+        def lines():
+            for data in self._stream_chunks(stream, offset,
+                                            STREAM_CHUNK_SIZE):
+                compressed, payload = _pack(data, self._compress)
+                sent[0] += len(payload)
+                sent[1] += 1
+                line = "{}{}\r\n".format("z" if compressed else "r",
+                                         util.b64encode(payload))
+                yield line.encode()
+
+        script = _STREAM_SCRIPT.format(part=_quote(part), offset=offset)
+        self._client.run_command_with_input(
+            script, lines(), command_type=util.POWERSHELL)
+        return sent
+
+    def _send_commands(self, stream, part, offset):
+        sent = [0, 0]
+        chunks = self._stream_chunks(stream, offset, _command_chunk_size())
+        if not offset:
+            # Make sure that the partial file is created for empty files.
+            chunks = _non_empty(chunks)
+        for data in chunks:
+            compressed, payload = _pack(data, self._compress)
+            cmd = _CHUNK_COMMAND.format(
+                data=util.b64encode(payload),
+                unpack=_CHUNK_UNPACK if compressed else "",
+                part=_quote(part), offset=offset)
+            self._client.run_remote_cmd(cmd, command_type=None)
+            offset += len(data)
+            sent[0] += len(payload)
+            sent[1] += 1
+        return sent
+
+    def upload(self, stream, remote_destination):
+        """Upload the content of the given binary stream.
+
+        :returns: A :class:`TransferStats` object.
+        """
+        stream.seek(0, 2)
+        size = stream.tell()
+        digest = _digest(stream).upper()
+        part = remote_destination + PART_SUFFIX
+        send = (self._send_streamed if self._client.supports_input
+                else self._send_commands)
+
+        start = time.time()
+        transferred = chunks = 0
+        resumed_from = None
+        state = self._policy.begin("the upload of {}".format(
+            remote_destination))
+        while True:
+            try:
+                offset = self._resume_offset(stream, size, part)
+                if resumed_from is None:
+                    resumed_from = offset
+                elif offset:
+                    LOG.debug("Resuming the upload of %s from offset %d.",
+                              remote_destination, offset)
+                sent, count = send(stream, part, offset)
+                transferred += sent
+                chunks += count
+                stdout, _, _ = self._client.run_remote_cmd(
+                    _FINALIZE_SCRIPT.format(
+                        path=_quote(part), digest=digest,
+                        destination=_quote(remote_destination)),
+                    command_type=util.POWERSHELL)
+                if stdout.strip():
+                    raise ChecksumMismatchError(
+                        "The upload of {!r} is corrupted: {}"
+                        .format(remote_destination, stdout.strip()))
+                state.done()
+                break
+            except Exception as exc:  # pylint: disable=broad-except
+                if not (isinstance(exc, ChecksumMismatchError) or
+                        retry.is_retryable(exc)):
+                    state.give_up()
+                    raise
+                if not state.wait():
+                    raise
+                LOG.debug("Uploading %s failed with %r, retrying...",
+                          remote_destination, exc)
+
+        elapsed = time.time() - start
+        LOG.info("Uploaded %d bytes to %s in %.2f seconds "
+                 "(%.1f KiB/s, %d bytes sent in %d chunks).",
+                 size, remote_destination, elapsed,
+                 size / 1024.0 / max(elapsed, 0.001), transferred, chunks)
+        return TransferStats(size, transferred, elapsed, chunks,
+                             resumed_from)
+
+
+class FileDownloader(object):
+    """Download files from a Windows instance.
+
+    :param client:
+        The :class:`argus.client.windows.WinRemoteClient` used
+        for the transfer.
+    :param compress:
+        Let the instance compress the chunks with gzip,
+        when it reduces their size.
+    :param chunk_size:
+        The number of bytes read with a single remote command.
+    :param retries:
+        How many times the reading of a chunk is retried.
+    """
+
+    def __init__(self, client, compress=False,
+                 chunk_size=DOWNLOAD_CHUNK_SIZE, retries=util.RETRY_COUNT):
+        self._client = client
+        self._compress = compress
+        self._chunk_size = chunk_size
+        self._policy = retry.RetryPolicy(max_attempts=retries + 1)
+
+    def _run(self, cmd):
+        state = self._policy.begin("a read")
+        while True:
+            try:
+                stdout = self._client.run_remote_cmd(
+                    cmd, command_type=util.POWERSHELL)[0]
+            except Exception as exc:  # pylint: disable=broad-except
+                if not retry.is_retryable(exc):
+                    state.give_up()
+                    raise
+                if not state.wait():
+                    raise
+                LOG.debug("Reading failed with %r, retrying...", exc)
+            else:
+                state.done()
+                return stdout
+
+    def _read_chunk(self, remote_source, offset, size):
+        stdout = self._run(_READ_SCRIPT.format(
+            path=_quote(remote_source), offset=offset, size=size,
+            compress="$true" if self._compress else "$false"))
+        stdout = stdout.strip()
+        payload = base64.b64decode(stdout[1:])
+        transferred = len(payload)
+        if stdout[:1] == "z":
+            payload = _gunzip(payload)
+        if len(payload) != size:
+            raise exceptions.ArgusError(
+                "Expected {} bytes from offset {} of {!r}, got {}."
+                .format(size, offset, remote_source, len(payload)))
+        return payload, transferred
+
+    def download(self, remote_source, stream):
+        """Download the given remote file into the binary stream.
+
+        Only the content which the remote file had when the download
+        started is retrieved, even if the file grows meanwhile.
+
+        :returns: A :class:`TransferStats` object.
+        """
+        stdout = self._run(_INFO_SCRIPT.format(path=_quote(remote_source)))
+        size, expected = stdout.split()
+        size = int(size)
+
+        start = time.time()
+        digest = hashlib.sha256()
+        transferred = chunks = 0
+        for offset in six.moves.range(0, size, self._chunk_size):
+            length = min(self._chunk_size, size - offset)
+            data, sent = self._read_chunk(remote_source, offset, length)
+            stream.write(data)
+            digest.update(data)
+            transferred += sent
+            chunks += 1
+
+        if digest.hexdigest() != expected.lower():
+            raise exceptions.ArgusError(
+                "The checksum of the downloaded {!r} doesn't match."
+                .format(remote_source))
+
+        elapsed = time.time() - start
+        LOG.info("Downloaded %d bytes from %s in %.2f seconds "
+                 "(%.1f KiB/s, %d bytes received in %d chunks).",
+                 size, remote_source, elapsed,
+                 size / 1024.0 / max(elapsed, 0.001), transferred, chunks)
+        return TransferStats(size, transferred, elapsed, chunks, 0)
@@ -15,37 +15,35 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
-import base64
-import functools
+import io
 import time
-import StringIO
 
 import six
 from winrm import protocol
 
+from argus.client import agent
 from argus.client import base
+from argus.client import batch
+from argus.client import conditions
+from argus.client import connection
+from argus.client import health
+from argus.client import pool
+from argus.client import readiness
+from argus.client import reboot
+from argus.client import scripts
+from argus.client import streaming
+from argus.client import transfer
 from argus import exceptions
+from argus import retry
 from argus import util
 from argus.action_manager.windows import get_windows_action_manager
 
 
 LOG = util.get_logger()
-CODEPAGE_UTF8 = 65001
 
-
-def _encode(data):
-    encoded = base64.b64encode(data)
-    if six.PY3:
-        encoded = encoded.decode()
-    return encoded
-
-
-def _base64_read_file(filepath, size=8192):
-    with open(filepath, 'rb') as stream:
-        reader = functools.partial(stream.read, size)
-        for data in iter(reader, b''):
-            encoded = _encode(data)
-            yield encoded
+# The operation timeout, in seconds, of the requests which wait for
+# the output of a command with a deadline.
+RECEIVE_TIMEOUT = 10
 
 
 class WinRemoteClient(base.BaseClient):
@@ -61,11 +59,22 @@ class WinRemoteClient(base.BaseClient):
         Client authentication certificate file path in PEM format.
     :param cert_key:
         Client authentication certificate key file path in PEM format.
+    :param use_agent:
+        Execute the PowerShell commands through a persistent
+        PowerShell agent running in the instance, instead of starting
+        a new PowerShell process for each of them. When the agent
+        can't be used, the commands are executed as usual.
+    :param instance_id:
+        The ID of the instance, used for caching what is known about
+        its OS between the clients of the same instance.
     """
     def __init__(self, hostname, username, password,
                  transport_protocol='http',
-                 cert_pem=None, cert_key=None):
+                 cert_pem=None, cert_key=None, use_agent=False,
+                 instance_id=None):
         super(WinRemoteClient, self).__init__(hostname)
+        self._host = hostname
+        self._instance_id = instance_id
         self._hostname = "{protocol}://{hostname}:{port}/wsman".format(
             protocol=transport_protocol,
             hostname=hostname,
@@ -74,63 +83,351 @@ class WinRemoteClient(base.BaseClient):
         self._password = password
         self._cert_pem = cert_pem
         self._cert_key = cert_key
-        self.manager = get_windows_action_manager(self)
+        self._port = 5985 if transport_protocol == 'http' else 5986
+        self._health = health.get_host_health(hostname, self._port)
+        self._reboot = None
+        self._generation = 0
+        self._connections = connection.ConnectionCache(
+            self._hostname, username, password,
+            cert_pem=cert_pem, cert_key=cert_key)
+        self._shell_pool = pool.ShellPool(self._get_protocol)
+        self._scripts = scripts.ScriptCache(self)
+        self._agent = None
+        if use_agent and self.supports_input:
+            self._agent = agent.PowerShellAgent(self._get_protocol)
+
+    @util.cached_property
+    def manager(self):
+        """The OS specific action manager, built on first use."""
+        return get_windows_action_manager(self)
+
+    @property
+    def hostname(self):
+        return self._host
+
+    @property
+    def instance_id(self):
+        return self._instance_id
+
+    @property
+    def generation(self):
+        """The number of reboots of the instance seen by the client.
+
+        What was learned about the instance is stale when this changes.
+        """
+        return self._generation
 
     @staticmethod
     def _run_command(protocol_client, shell_id, command,
-                     command_type=util.POWERSHELL):
+                     command_type=util.POWERSHELL, stdin=None,
+                     timeout=None, receiver=None):
         command_id = None
         bare_command = command
 
         command = util.get_command(command, command_type)
 
         try:
-            command_id = protocol_client.run_command(shell_id, command)
-            stdout, stderr, exit_code = protocol_client.get_command_output(
-                shell_id, command_id)
-            if exit_code:
-                output = "\n\n".join([out for out in (stdout, stderr) if out])
-                raise exceptions.ArgusError(
-                    "Executing command {command!r} with encoded Command"
-                    "{encoded_command!r} failed with exit code {exit_code!r}"
-                    " and output {output!r}."
-                    .format(command=bare_command,
-                            encoded_command=command,
-                            exit_code=exit_code,
-                            output=output))
-
-            return stdout, stderr, exit_code
+            command_id = protocol_client.run_command(
+                shell_id, command, console_mode_stdin=stdin is None)
+            if stdin is not None:
+                for data in stdin:
+                    protocol_client.send_command_input(
+                        shell_id, command_id, data)
+                protocol_client.send_command_input(
+                    shell_id, command_id, b'', end=True)
+            if timeout is None:
+                stdout, stderr, exit_code = (
+                    protocol_client.get_command_output(shell_id, command_id))
+            else:
+                stdout, stderr, exit_code = WinRemoteClient._wait_output(
+                    receiver or protocol_client, shell_id, command_id,
+                    bare_command, timeout)
+            return WinRemoteClient._check_exit_code(
+                bare_command, command, stdout, stderr, exit_code)
         finally:
+            # This terminates the command, if it is still running.
             protocol_client.cleanup_command(shell_id, command_id)
 
-    def _run_commands(self, commands, commands_type=util.POWERSHELL):
-        protocol_client = self._get_protocol()
-        shell_id = protocol_client.open_shell(codepage=CODEPAGE_UTF8)
+    @staticmethod
+    def _wait_output(receiver, shell_id, command_id, command, timeout):
+        """Get the output of a command, waiting for at most `timeout`."""
+        stdout, stderr, exit_code = [], [], None
         try:
-            results = [self._run_command(protocol_client, shell_id, command,
-                                         command_type=commands_type)
-                       for command in commands]
+            for out, err, exit_code, _ in streaming.receive(
+                    receiver, shell_id, command_id,
+                    deadline=time.time() + timeout):
+                stdout.append(out)
+                stderr.append(err)
+        except exceptions.ArgusCommandTimeout:
+            raise exceptions.ArgusCommandTimeout(
+                "Command {!r} didn't finish in {} seconds."
+                .format(command, timeout),
+                command=command, timeout=timeout)
+        return b"".join(stdout), b"".join(stderr), exit_code
+
+    @staticmethod
+    def _check_exit_code(bare_command, command, stdout, stderr, exit_code):
+        """Raise an error if the command failed, else return its output."""
+        if exit_code:
+            output = "\n\n".join([out for out in (stdout, stderr) if out])
+            raise exceptions.ArgusCommandError(
+                "Executing command {command!r} with encoded Command"
+                "{encoded_command!r} failed with exit code {exit_code!r}"
+                " and output {output!r}."
+                .format(command=bare_command,
+                        encoded_command=command,
+                        exit_code=exit_code,
+                        output=output),
+                exit_code=exit_code, stdout=stdout, stderr=stderr)
+
+        return stdout, stderr, exit_code
+
+    def _run_commands(self, commands, commands_type=util.POWERSHELL,
+                      timeout=None):
+        # The over-long commands are run from scripts, which are
+        # uploaded before taking the shell for the commands.
+        commands = [self._scripts.spill(command, commands_type)
+                    for command in commands]
+        with self._health.guard(), self._shell_pool.shell() as shell:
+            receiver = None
+            if timeout is not None:
+                # Wait for the output in short operations, in order to
+                # notice the deadline soon after it passes.
+                receiver = self._get_protocol(min(timeout, RECEIVE_TIMEOUT))
+            try:
+                return [self._run_command(shell.protocol, shell.shell_id,
+                                          command,
+                                          command_type=command_type,
+                                          timeout=timeout,
+                                          receiver=receiver)
+                        for command, command_type in commands]
+            except exceptions.ArgusCommandTimeout:
+                # The shell might still be busy with the command.
+                self._shell_pool.discard(shell)
+                raise
+
+    @property
+    def supports_input(self):
+        """Whether data can be sent to the standard input of a command."""
+        return hasattr(protocol.Protocol, "send_command_input")
+
+    def _get_protocol(self, timeout=None):
+        return self._connections.protocol(timeout)
+
+    @property
+    def connection_stats(self):
+        """The protocol, HTTP request and connection counters."""
+        return self._connections.stats
+
+    @property
+    def health_stats(self):
+        """The state of the circuit breaker of the host."""
+        return self._health.stats
+
+    @property
+    def shell_stats(self):
+        """The hit, miss and rebuild counters of the shell pool."""
+        return self._shell_pool.stats
+
+    def invalidate_shells(self):
+        """Forget the pooled shells, since they are not valid anymore.
+
+        This should be called when the instance is known to have
+        been rebooted.
+        """
+        self._generation += 1
+        self._shell_pool.invalidate()
+        self._connections.reset()
+        self._health.reset()
+        if self._agent:
+            with self._agent.lock:
+                self._agent.stop()
+
+    def close(self):
+        """Close the pooled shells and the agent of the client.
+
+        The client can still be used afterwards, new shells
+        are opened when needed.
+        """
+        self._shell_pool.close()
+        if self._agent:
+            with self._agent.lock:
+                self._agent.stop()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def script_stats(self):
+        """How many scripts were found, uploaded and spilled."""
+        return self._scripts.stats
+
+    def get_script_path(self, script):
+        """Get the path of the given PowerShell script, in the instance.
+
+        The script is uploaded only if it isn't already there.
+        """
+        return self._scripts.path(script)
+
+    def wait_ready(self, policy=None):
+        """Wait until the instance accepts commands.
+
+        The instance is probed in layers, from a TCP connection to
+        a logon, see :mod:`argus.client.readiness`.
+
+        :param policy:
+            The :class:`argus.retry.RetryPolicy` of the checks.
+        :returns: The latency of each layer, in seconds.
+        """
+        probe = readiness.ReadinessProbe(self, self._host, self._port,
+                                         self._hostname)
+        return probe.wait(policy)
+
+    def expect_reboot(self):
+        """Tell the client that the instance is about to reboot.
+
+        This should be called before triggering the reboot. Use
+        `wait_for_reboot` for waiting until the instance is back.
+        """
+        self._reboot = reboot.RebootWatcher(self, self._host, self._port,
+                                            self._hostname)
+        self._reboot.start()
+
+    def wait_for_reboot(self, timeout=reboot.REBOOT_TIMEOUT):
+        """Wait for the expected reboot to finish.
+
+        This returns as soon as a command can be executed again with
+        the client's credentials, after the instance went down.
+
+        :param timeout:
+            The number of seconds to wait for the instance.
+        :returns:
+            A list of the phases of the reboot, with their timestamps.
+        """
+        if self._reboot is None:
+            raise exceptions.ArgusError("No reboot was expected.")
+        try:
+            transitions = self._reboot.wait(timeout)
         finally:
-            protocol_client.close_shell(shell_id)
-        return results
-
-    def _get_protocol(self):
-        protocol.Protocol.DEFAULT_TIMEOUT = "PT3600S"
-        return protocol.Protocol(endpoint=self._hostname,
-                                 transport='plaintext',
-                                 username=self._username,
-                                 password=self._password,
-                                 cert_pem=self._cert_pem,
-                                 cert_key_pem=self._cert_key)
-
-    def run_remote_cmd(self, cmd, command_type=util.POWERSHELL):
+            self._reboot = None
+        self.invalidate_shells()
+        return transitions
+
+    def _run_agent_command(self, cmd):
+        """Run a PowerShell command through the agent.
+
+        Return None if the agent can't be used, for instance when
+        it is busy with another command.
+        """
+        powershell_agent = self._agent
+        if not powershell_agent or not powershell_agent.lock.acquire(False):
+            return None
+        try:
+            if not powershell_agent.running:
+                try:
+                    powershell_agent.start()
+                except Exception as exc:  # pylint: disable=broad-except
+                    LOG.warning("The PowerShell agent can't be started, "
+                                "it will not be used anymore: %r", exc)
+                    powershell_agent.stop()
+                    self._agent = None
+                    return None
+            try:
+                with self._health.guard():
+                    result = powershell_agent.execute(cmd)
+            except agent.AgentUnavailableError as exc:
+                # The command didn't reach the agent, so it can
+                # be executed directly without running it twice.
+                LOG.debug("The PowerShell agent failed with %r, falling "
+                          "back to executing the command directly.", exc)
+                return None
+        finally:
+            powershell_agent.lock.release()
+        return self._check_exit_code(cmd, cmd, *result)
+
+    def run_remote_cmd(self, cmd, command_type=util.POWERSHELL,
+                       timeout=None):
         """Run the given remote command.
 
         The command will be executed on the remote underlying server.
         It will return a tuple of three elements, stdout, stderr
         and the return code of the command.
+
+        :param timeout:
+            The number of seconds after which the command is terminated
+            and :class:`argus.exceptions.ArgusCommandTimeout` is raised.
         """
-        return self._run_commands([cmd], command_type)[0]
+        if command_type == util.POWERSHELL and timeout is None:
+            # The commands of the agent can't be terminated.
+            result = self._run_agent_command(cmd)
+            if result is not None:
+                return result
+        return self._run_commands([cmd], command_type, timeout=timeout)[0]
+
+    def run_batch(self, commands, command_type=util.POWERSHELL):
+        """Run multiple commands with as few remote invocations as possible.
+
+        :param commands:
+            A list of commands. An item can also be a tuple of two
+            elements, the command and its type, otherwise `command_type`
+            is used.
+        :param command_type:
+            The default type of the commands.
+
+        Unlike :meth:`run_command`, a command which fails doesn't
+        raise an error and doesn't stop the rest of the batch.
+
+        :rtype: list
+        :returns: A tuple of stdout, stderr, exit_code for each command.
+        """
+        commands = [item if isinstance(item, tuple) else (item, command_type)
+                    for item in commands]
+        if not commands:
+            return []
+
+        marker = batch.new_marker()
+        batches = batch.build_scripts(commands, marker)
+        LOG.info("Running %d commands in %d batches...",
+                 len(commands), len(batches))
+        results = self._run_commands(batches, commands_type=util.POWERSHELL)
+        output = "\n".join(stdout for stdout, _, _ in results)
+        return batch.parse_results(output, marker, len(commands))
+
+    def run_command_with_input(self, cmd, stdin,
+                               command_type=util.POWERSHELL):
+        """Run the given command, sending data to its standard input.
+
+        :param stdin:
+            An iterable of byte strings, which are sent in order
+            to the standard input of the command, after which
+            the input is closed.
+        :rtype: tuple
+        :returns: stdout, stderr, exit_code
+        """
+        with self._health.guard(), self._shell_pool.shell() as shell:
+            return self._run_command(shell.protocol, shell.shell_id, cmd,
+                                     command_type=command_type, stdin=stdin)
+
+    def upload_file(self, source, remote_destination, compress=False):
+        """Upload a file to the remote destination.
+
+        :param source:
+            A path to a local file or a binary file object.
+        :param remote_destination:
+            The file which will be created, or overwritten,
+            with the content of the source.
+        :param compress:
+            Compress the data sent over the wire, if it's worth it.
+        :returns: A :class:`argus.client.transfer.TransferStats` object.
+        """
+        uploader = transfer.FileUploader(self, compress=compress)
+        if hasattr(source, "read"):
+            return uploader.upload(source, remote_destination)
+        with open(source, "rb") as stream:
+            return uploader.upload(stream, remote_destination)
 
     def copy_file(self, filepath, remote_destination):
         """Copy the given filepath in the remote destination.
@@ -138,21 +435,8 @@ class WinRemoteClient(base.BaseClient):
         The remote destination is the file name where the content
         of filepath will be written.
         """
-
-        # TODO(cpopa): This powershell dance is a little complicated,
-        # find a simpler way to send a file over a remote server,
-        # without relying on OpenStack infra.
-        get_string_cmd = ("[System.Text.Encoding]::UTF8.GetString("
-                          "[System.Convert]::FromBase64String('{}'))")
-        commands = []
-        for command in _base64_read_file(filepath):
-            remote_command = (
-                "{content} >> '{remote_destination}'"
-                .format(content=get_string_cmd.format(command),
-                        remote_destination=remote_destination))
-
-            commands.append(remote_command)
-        self._run_commands(commands, commands_type=util.POWERSHELL)
+        LOG.debug("Copy file %s to %s", filepath, remote_destination)
+        self.upload_file(filepath, remote_destination, compress=True)
 
     def write_file(self, data, remote_destination):
         """Copy the given data in the remote destination.
@@ -161,40 +445,109 @@ class WinRemoteClient(base.BaseClient):
         of filepath will be written.
         """
         LOG.debug("Write data in file %s", remote_destination)
-
-        # TODO(mmicu): This powershell dance is a little complicated,
-        # find a simpler way to send a file over a remote server,
-        # without relying on OpenStack infra.
-        get_string_cmd = ("[System.Text.Encoding]::UTF8.GetString("
-                          "[System.Convert]::FromBase64String('{}'))")
-        commands = []
-        data = StringIO.StringIO(data)
-        data.seek(0)
-        content = data.read(1024)
-        while content:
-            remote_command = (
-                "{content} >> '{remote_destination}'"
-                .format(content=get_string_cmd.format(_encode(content)),
-                        remote_destination=remote_destination))
-
-            commands.append(remote_command)
-            content = data.read(1024)
-        self._run_commands(commands, commands_type=util.POWERSHELL)
+        if isinstance(data, six.text_type):
+            data = data.encode("utf-8")
+        self.upload_file(io.BytesIO(data), remote_destination, compress=True)
+
+    def download_file(self, remote_source, local_destination,
+                      compress=True):
+        """Download a remote file into a local one.
+
+        The file is transferred in chunks, which are written
+        to the local file as soon as they arrive.
+
+        :param remote_source: The path of the remote file.
+        :param local_destination:
+            A path to a local file or a binary file object.
+        :param compress:
+            Compress the data sent over the wire, if it's worth it.
+        :returns: A :class:`argus.client.transfer.TransferStats` object.
+        """
+        downloader = transfer.FileDownloader(self, compress=compress)
+        if hasattr(local_destination, "write"):
+            return downloader.download(remote_source, local_destination)
+        with open(local_destination, "wb") as stream:
+            return downloader.download(remote_source, stream)
 
     def read_file(self, filepath):
         """Get the content of the given file."""
         cmd = 'Get-Content "{}"'.format(filepath)
         return self.run_remote_cmd(cmd, command_type=util.POWERSHELL)[0]
 
-    def run_command(self, cmd, command_type=util.POWERSHELL):
+    def run_command(self, cmd, command_type=util.POWERSHELL, timeout=None):
         """Run the given command and return execution details.
 
+        :param timeout:
+            The number of seconds after which the command is terminated
+            and :class:`argus.exceptions.ArgusCommandTimeout` is raised.
         :rtype: tuple
         :returns: stdout, stderr, exit_code
         """
 
         LOG.info("Running command %s...", cmd)
-        return self.run_remote_cmd(cmd, command_type=command_type)
+        return self.run_remote_cmd(cmd, command_type=command_type,
+                                   timeout=timeout)
+
+    def stream_command(self, cmd, command_type=util.POWERSHELL,
+                       on_line=None, spool_size=None, stop_pattern=None,
+                       timeout=None):
+        """Run the given command, handling its output as it arrives.
+
+        :param on_line:
+            A callable receiving each line of the output, as soon
+            as it is received.
+        :param spool_size:
+            Keep at most this number of bytes of each output stream
+            in memory, the rest being spilled to a temporary file.
+        :param stop_pattern:
+            A regular expression. The command is terminated as soon
+            as a line of its output matches it.
+        :param timeout:
+            The number of seconds after which the command is terminated
+            and :class:`argus.exceptions.ArgusCommandTimeout` is raised.
+        :rtype: :class:`argus.client.streaming.StreamResult`
+        :raises:
+            :class:`argus.exceptions.ArgusCommandError` if the command
+            fails, unless it was stopped.
+        """
+        LOG.info("Running command %s...", cmd)
+        sink = streaming.OutputSink(on_line=on_line, spool_size=spool_size,
+                                    stop_pattern=stop_pattern)
+        exit_code = deadline = None
+        receiver = None
+        if timeout is not None:
+            deadline = time.time() + timeout
+            receiver = self._get_protocol(min(timeout, RECEIVE_TIMEOUT))
+        command, command_type = self._scripts.spill(cmd, command_type)
+        with self._health.guard(), self._shell_pool.shell() as shell:
+            command_id = shell.protocol.run_command(
+                shell.shell_id, util.get_command(command, command_type))
+            try:
+                try:
+                    for stdout, stderr, exit_code, _ in streaming.receive(
+                            receiver or shell.protocol, shell.shell_id,
+                            command_id, deadline=deadline):
+                        stopped = sink.feed(streaming.STDOUT, stdout)
+                        stopped = (sink.feed(streaming.STDERR, stderr) or
+                                   stopped)
+                        if stopped:
+                            break
+                finally:
+                    # This also terminates the command, if it was stopped.
+                    shell.protocol.cleanup_command(shell.shell_id,
+                                                   command_id)
+            except exceptions.ArgusCommandTimeout:
+                # The shell might still be busy with the command.
+                self._shell_pool.discard(shell)
+                raise exceptions.ArgusCommandTimeout(
+                    "Command {!r} didn't finish in {} seconds."
+                    .format(cmd, timeout), command=cmd, timeout=timeout)
+
+        result = sink.result(exit_code)
+        if not result.stopped:
+            self._check_exit_code(cmd, cmd, result.stdout, result.stderr,
+                                  result.exit_code)
+        return result
 
     def run_command_verbose(self, cmd, command_type=util.POWERSHELL):
         """Run the given command and log anything it returns.
@@ -213,7 +566,9 @@ class WinRemoteClient(base.BaseClient):
 
     def run_command_with_retry(self, cmd, count=util.RETRY_COUNT,
                                delay=util.RETRY_DELAY,
-                               command_type=util.POWERSHELL):
+                               command_type=util.POWERSHELL, policy=None,
+                               retry_exit_codes=False, on_line=None,
+                               timeout=None):
         """Run the given `cmd` until succeeds.
 
         :param cmd:
@@ -223,74 +578,134 @@ class WinRemoteClient(base.BaseClient):
             The number of retries which this function has.
             If the value is ``None``, then the function will retry *forever*.
         :param delay:
-            The number of seconds to sleep when retrying a command.
+            The maximum number of seconds to sleep when retrying a command.
+        :param policy:
+            A :class:`argus.retry.RetryPolicy` used instead of
+            the one given by `count` and `delay`.
+        :param retry_exit_codes:
+            Only the transport, authentication and timeout errors
+            are retried by default. Pass True for retrying the command
+            when it fails as well, or a list of the exit codes which
+            should be retried.
+        :param on_line:
+            When given, the output of the command is streamed and
+            each line of it is passed to this callable, as soon as it
+            is received. See `stream_command`.
+        :param timeout:
+            The number of seconds after which each attempt is
+            terminated. The attempts which time out are retried.
 
         :rtype: tuple
         :returns: stdout, stderr, exit_code
         """
+        if policy is None:
+            policy = retry.RetryPolicy.from_count(count, delay)
 
-        # Countdown normalization.
-        if not count or count < 0:
-            count = 0
-
+        state = policy.begin("command {!r}".format(cmd))
         while True:
             try:
-                return self.run_command(cmd, command_type=command_type)
+                if on_line is None:
+                    result = self.run_command(cmd, command_type=command_type,
+                                              timeout=timeout)
+                else:
+                    streamed = self.stream_command(
+                        cmd, command_type=command_type, on_line=on_line,
+                        timeout=timeout)
+                    result = (streamed.stdout, streamed.stderr,
+                              streamed.exit_code)
             except Exception as exc:  # pylint: disable=broad-except
                 LOG.debug("Command failed with %r.", exc)
-                # A negative `count` means no count at all.
-                if count >= 0:
-                    count -= 1
-                if count == 0:
+                if not retry.is_retryable(exc, retry_exit_codes):
+                    state.give_up()
+                    raise
+                if not state.wait():
                     raise exceptions.ArgusTimeoutError(
                         "Command {!r} failed too many times."
                         .format(cmd))
                 LOG.debug("Retrying...")
-                time.sleep(delay)
+            else:
+                state.done()
+                return result
 
     def run_command_until_condition(self, cmd, cond,
                                     retry_count=util.RETRY_COUNT,
                                     delay=util.RETRY_DELAY,
-                                    command_type=util.POWERSHELL):
+                                    command_type=util.POWERSHELL,
+                                    policy=None, retry_exit_codes=False,
+                                    poll_in_guest=True, timeout=None):
         """Run the given `cmd` until a condition `cond` occurs.
 
         :param cond:
             A callable which receives the standard output returned by
             executing the command. It should return a boolean value,
             which tells to this function to stop execution.
+        :param policy:
+            A :class:`argus.retry.RetryPolicy` used instead of
+            the one given by `retry_count` and `delay`.
+        :param retry_exit_codes:
+            Retry the command when it fails, as for
+            `run_command_with_retry`.
+        :param poll_in_guest:
+            When `cond` is a :class:`argus.client.conditions.Condition`,
+            the command is polled by a loop running in the instance,
+            for as long as the retry policy allows. Only the errors
+            of the loop itself are retried from the host.
+        :param timeout:
+            The number of seconds after which each attempt is
+            terminated.
         :raises:
             `ArgusCLIError` if there is output found in the standard error.
 
         This method uses and behaves like `run_command_with_retry` but
         with an additional condition parameter.
         """
+        if policy is None:
+            if not retry_count or retry_count < 0:
+                policy = retry.RetryPolicy(max_attempts=1)
+            else:
+                policy = retry.RetryPolicy.from_count(retry_count, delay)
 
-        # countdown normalization
-        if not retry_count or retry_count < 0:
-            retry_count = 0
-
+        in_guest = poll_in_guest and isinstance(cond, conditions.Condition)
+        state = policy.begin("condition of {!r}".format(cmd))
         while True:
+            probe, probe_type, check = cmd, command_type, cond
+            if in_guest:
+                budget = state.remaining()
+                poll_timeout = min(
+                    conditions.POLL_TIMEOUT if budget is None else budget,
+                    timeout or conditions.POLL_TIMEOUT)
+                probe = cond.poll_script(cmd, command_type, poll_timeout)
+                probe_type = util.POWERSHELL
+                check = conditions.Equals("True")
+
             try:
                 stdout, stderr, exit_code = self.run_command(
-                    cmd, command_type=command_type)
+                    probe, command_type=probe_type, timeout=timeout)
             except Exception as exc:  # pylint: disable=broad-except
                 LOG.debug("Command failed with %r.", exc)
+                if not retry.is_retryable(exc, retry_exit_codes):
+                    state.give_up()
+                    raise
             else:
                 if stderr and exit_code:
                     raise exceptions.ArgusCLIError(
                         ("Executing command {!r} failed with {!r}"
                          " and exit code {}.")
                         .format(cmd, stderr, exit_code))
-                elif cond(stdout):
+                elif check(stdout):
+                    state.done()
                     return
+                elif (in_guest and budget is not None and
+                      poll_timeout >= budget):
+                    # The guest already polled for the whole budget.
+                    break
                 else:
                     LOG.debug("Condition not met, retrying...")
 
-            if retry_count > 0:
-                retry_count -= 1
-                LOG.debug("Retrying...")
-                time.sleep(delay)
-            else:
-                raise exceptions.ArgusTimeoutError(
-                    "Command {!r} failed too many times."
-                    .format(cmd))
+            if not state.wait():
+                break
+            LOG.debug("Retrying...")
+
+        raise exceptions.ArgusTimeoutError(
+            "Command {!r} failed too many times."
+            .format(cmd))
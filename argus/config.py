@@ -15,6 +15,8 @@
 
 import collections
 import itertools
+import os
+import tempfile
 
 import six
 
@@ -41,6 +43,13 @@ def _get_default(parser, section, option, default=None):
         return default
 
 
+def _get_boolean(parser, section, option, default=False):
+    try:
+        return parser.getboolean(section, option)
+    except six.moves.configparser.NoOptionError:
+        return default
+
+
 class ConfigurationParser(object):
     """A parser class which knows how to parse argus configurations."""
 
@@ -59,7 +68,14 @@ class ConfigurationParser(object):
                                        'resources pause '
                                        'file_log log_format dns_nameservers '
                                        'output_directory build arch '
-                                       'patch_install git_command')
+                                       'patch_install git_command '
+                                       'powershell_agent resource_bundle '
+                                       'resource_server resource_server_port '
+                                       'resource_cache_dir '
+                                       'resource_cache_size '
+                                       'introspection_snapshot '
+                                       'snapshot_cache snapshot_max_age '
+                                       'snapshot_max_count')
         resources = _get_default(
             self._parser, 'argus', 'resources', self.RESOURCES_LINK)
         pause = self._parser.getboolean('argus', 'pause')
@@ -76,10 +92,36 @@ class ConfigurationParser(object):
         arch = _get_default(self._parser, 'argus', 'arch', 'x64')
         patch_install = _get_default(self._parser, 'argus', 'patch_install')
         git_command = _get_default(self._parser, 'argus', 'git_command')
+        powershell_agent = _get_boolean(self._parser, 'argus',
+                                        'powershell_agent')
+        resource_bundle = _get_boolean(self._parser, 'argus',
+                                       'resource_bundle')
+        resource_server = _get_boolean(self._parser, 'argus',
+                                       'resource_server')
+        resource_server_port = int(_get_default(
+            self._parser, 'argus', 'resource_server_port', 2010))
+        resource_cache_dir = _get_default(
+            self._parser, 'argus', 'resource_cache_dir',
+            os.path.join(tempfile.gettempdir(), 'argus-cache'))
+        # The maximum size of the cached files, in MiB.
+        resource_cache_size = int(_get_default(
+            self._parser, 'argus', 'resource_cache_size', 2048))
+        introspection_snapshot = _get_boolean(self._parser, 'argus',
+                                              'introspection_snapshot')
+        snapshot_cache = _get_boolean(self._parser, 'argus', 'snapshot_cache')
+        # The number of hours a snapshot of an installation is reused.
+        snapshot_max_age = int(_get_default(
+            self._parser, 'argus', 'snapshot_max_age', 24))
+        snapshot_max_count = int(_get_default(
+            self._parser, 'argus', 'snapshot_max_count', 5))
 
         return argus(resources, pause, file_log, log_format,
                      dns_nameservers, output_directory, build, arch,
-                     patch_install, git_command)
+                     patch_install, git_command, powershell_agent,
+                     resource_bundle, resource_server, resource_server_port,
+                     resource_cache_dir, resource_cache_size,
+                     introspection_snapshot, snapshot_cache,
+                     snapshot_max_age, snapshot_max_count)
 
     @property
     def cloudbaseinit(self):
@@ -23,9 +23,37 @@ class ArgusTimeoutError(ArgusError):
     pass
 
 
+class ArgusCommandTimeout(ArgusTimeoutError):
+    """A remote command didn't finish before its deadline."""
+
+    def __init__(self, message, command=None, timeout=None):
+        super(ArgusCommandTimeout, self).__init__(message)
+        self.command = command
+        self.timeout = timeout
+
+
+class ArgusCircuitOpenError(ArgusError):
+    """The host is known to be unreachable, so the call wasn't made."""
+
+    def __init__(self, message, cause=None):
+        super(ArgusCircuitOpenError, self).__init__(message)
+        self.cause = cause
+
+
 class ArgusCLIError(ArgusError):
     pass
 
+
+class ArgusCommandError(ArgusError):
+    """A remote command finished with a non-zero exit code."""
+
+    def __init__(self, message, exit_code=None, stdout=None, stderr=None):
+        super(ArgusCommandError, self).__init__(message)
+        self.exit_code = exit_code
+        self.stdout = stdout
+        self.stderr = stderr
+
+
 class ArgusPermissionDenied(ArgusError):
     pass
 
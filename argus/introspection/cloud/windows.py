@@ -14,19 +14,25 @@
 #    under the License.
 
 
+import base64
+import codecs
 import collections
 import contextlib
+import json
 import ntpath
 import os
-import re
 import shutil
 import tempfile
+import threading
+import time
 
 from argus.introspection.cloud import base
 from argus import exceptions
 from argus import util
 
 
+LOG = util.get_logger()
+
 # escaped characters for powershell paths
 ESC = "( )"
 SEP = "----\r\n"    # default separator for network details blocks
@@ -35,6 +41,147 @@ NIC_KEYS = ["mac", "address", "gateway", "netmask", "dns", "dhcp"]
 Address = collections.namedtuple("Address", ["v4", "v6"])
 NICDetails = collections.namedtuple("NICDetails", NIC_KEYS)
 
+# The results of the JSON queries, whose fields are named
+# after the properties emitted by the queries.
+Interface = collections.namedtuple("Interface", ["alias", "index", "mtu"])
+Account = collections.namedtuple("Account", ["name", "domain"])
+ServiceTrigger = collections.namedtuple("ServiceTrigger",
+                                        ["action", "type", "subtype"])
+License = collections.namedtuple("License", ["name", "status"])
+InstallLayout = collections.namedtuple(
+    "InstallLayout", ["cbinit_dir", "python_dir", "conf_path",
+                      "site_packages", "registry_key"])
+
+TRIGGER_ACTION_START = 1
+TRIGGER_ACTION_STOP = 2
+# The names of the trigger types, as displayed by `sc qtriggerinfo`.
+TRIGGER_TYPES = {
+    1: "DEVICE INTERFACE ARRIVAL",
+    2: "IP ADDRESS AVAILABILITY",
+    3: "DOMAIN JOINED STATUS",
+    4: "FIREWALL PORT EVENT",
+    5: "GROUP POLICY",
+    6: "NETWORK EVENT",
+    20: "CUSTOM",
+}
+
+_INTERFACES_QUERY = (
+    "Get-NetIPInterface -AddressFamily IPv4 | Sort-Object InterfaceIndex | "
+    "Select-Object @{n='alias';e={$_.InterfaceAlias}},"
+    "@{n='index';e={$_.InterfaceIndex}},@{n='mtu';e={$_.NlMtu}} | "
+    "ConvertTo-Json -Compress")
+_NTP_PEERS_QUERY = (
+    "@(w32tm /query /peers | Where-Object {$_ -like 'Peer: *'} | "
+    "ForEach-Object {$_.Substring(6)}) | ConvertTo-Json -Compress")
+_GROUP_MEMBERS_QUERY = (
+    "$g=Get-CimInstance Win32_Group "
+    "-Filter \"LocalAccount=True AND Name='{group}'\";"
+    "if(-not $g){{throw 'Unable to find the group {group}.'}};"
+    "Get-CimAssociatedInstance -InputObject $g -Association Win32_GroupUser | "
+    "Select-Object @{{n='name';e={{$_.Name}}}},"
+    "@{{n='domain';e={{$_.Domain}}}} | ConvertTo-Json -Compress")
+_SERVICE_TRIGGERS_QUERY = (
+    r"$k='HKLM:\SYSTEM\CurrentControlSet\Services\{service}\TriggerInfo';"
+    r"@(if(Test-Path $k){{Get-ChildItem $k | "
+    r"Sort-Object {{[int]$_.PSChildName}} | ForEach-Object {{"
+    r"$p=Get-ItemProperty $_.PSPath;New-Object PSObject -Property @{{"
+    r"action=$p.Action;type=$p.Type;subtype=$(if($p.Guid){{"
+    r"(New-Object Guid(,[byte[]]$p.Guid)).ToString()}})}}}}}}) | "
+    r"ConvertTo-Json -Compress")
+CBINIT_KEY = "HKLM:SOFTWARE\\Cloudbase` Solutions\\Cloudbase-init"
+CBINIT_KEY_X64 = ("HKLM:SOFTWARE\\Wow6432Node\\Cloudbase` Solutions\\"
+                  "Cloudbase-init")
+
+# Find the installation of cloudbase-init in the program files,
+# then its Python directory and its registry key, all at once.
+_INSTALL_LAYOUT_QUERY = (
+    "$k='HKLM:SOFTWARE\\Cloudbase Solutions\\Cloudbase-init';"
+    "foreach($d in @($env:ProgramFiles,${env:ProgramFiles(x86)})){"
+    "if($d -and "
+    "(Test-Path -LiteralPath (Join-Path $d 'Cloudbase Solutions'))){"
+    "$c=Join-Path $d 'Cloudbase Solutions\\Cloudbase-Init';"
+    "$p=@(Get-ChildItem -LiteralPath $c | "
+    "Where-Object {$_.Name -like '*python*'})[0];"
+    "ConvertTo-Json -Compress -InputObject @{cbinit_dir=$c;"
+    "python_dir=$(if($p){$p.FullName});native_key=(Test-Path $k)};break}}")
+
+_INSTALL_LAYOUTS = {}
+_INSTALL_LAYOUTS_LOCK = threading.Lock()
+
+# The maximum number of bytes read from a file, and from all the files,
+# by a single call of :meth:`InstanceIntrospection.get_files_content`.
+MAX_FILE_SIZE = 1024 * 1024
+MAX_TOTAL_SIZE = 4 * 1024 * 1024
+
+_FILES_CONTENT_QUERY = r"""$left={max_total_size};$r=@()
+foreach($p in @({paths})){{
+$o=@{{path=$p;exists=$false;size=0;truncated=$false;content=''}}
+if(Test-Path -LiteralPath $p -PathType Leaf){{$o.exists=$true
+$s=[IO.File]::Open($p,'Open','Read','ReadWrite')
+try{{$o.size=$s.Length
+$n=[Math]::Max([Math]::Min([Math]::Min($s.Length,{max_size}),$left),0)
+$b=New-Object byte[] $n;$k=0
+while($k -lt $n){{$c=$s.Read($b,$k,$n-$k);if(!$c){{break}};$k+=$c}}
+$o.content=[Convert]::ToBase64String($b,0,$k)
+$o.truncated=$k -lt $s.Length;$left-=$k}}finally{{$s.Close()}}}}
+$r+=New-Object PSObject -Property $o}}
+ConvertTo-Json -Compress -InputObject @($r)
+"""
+_PATHS_EXIST_QUERY = (
+    "ConvertTo-Json -Compress -InputObject "
+    "@(foreach($p in @({paths})){{Test-Path -LiteralPath $p}})")
+_LIST_LOCATIONS_QUERY = (
+    "ConvertTo-Json -Compress -Depth 3 -InputObject "
+    "@(foreach($l in @({locations})){{New-Object PSObject -Property @{{"
+    "location=$l;names=$(if(Test-Path -LiteralPath $l -PathType Container)"
+    "{{,@(Get-ChildItem -LiteralPath $l -Name)}})}}}})")
+_LICENSES_QUERY = (
+    "Get-CimInstance SoftwareLicensingProduct "
+    "-Filter 'PartialProductKey IS NOT NULL' | "
+    "Select-Object @{n='name';e={$_.Name}},"
+    "@{n='status';e={$_.LicenseStatus}} | ConvertTo-Json -Compress")
+
+DEFAULT_SECTION = "DEFAULT"
+
+# Apply the edits of a ConfigEditor to the configuration file in $path.
+# The edits are written to a temporary file, which replaces the
+# configuration file only if everything went well. The values of the
+# edited options are read back from the configuration file afterwards.
+_CONFIG_EDIT_SCRIPT = r"""$ErrorActionPreference='Stop'
+function Get-Values($file){
+$r=@{};$s='DEFAULT'
+foreach($l in @(Get-Content -LiteralPath $file)){$t=$l.Trim()
+if($t -match '^\[(.+)\]$'){$s=$matches[1]}
+elseif($t -match '^([^#;=]+?)\s*=\s*(.*)$'){
+$r["$s/$($matches[1])"]=$matches[2]}}
+$r}
+$all=ConvertFrom-Json $edits
+$lines=New-Object Collections.ArrayList
+$lines.AddRange(@(Get-Content -LiteralPath $path))
+foreach($e in $all){
+$s='DEFAULT';$header=-1;$last=-1;$found=$false;$i=0
+while($i -lt $lines.Count){$t=$lines[$i].Trim()
+if($t -match '^\[(.+)\]$'){
+$s=$matches[1];if($s -ceq $e.section){$header=$i;$last=$i}}
+elseif($s -ceq $e.section){
+if($t -match '^([^#;=]+?)\s*=' -and $matches[1] -ceq $e.key){
+if($found){$lines.RemoveAt($i);continue}
+$lines[$i]="$($e.key) = $($e.value)";$found=$true}
+if($t){$last=$i}}
+$i++}
+if(-not $found){
+if($header -lt 0 -and $e.section -cne 'DEFAULT'){
+$lines.Add("[$($e.section)]")|Out-Null;$last=$lines.Count-1}
+$lines.Insert($last+1,"$($e.key) = $($e.value)")}}
+$tmp="$path.argus"
+try{Set-Content -LiteralPath $tmp -Value $lines
+Move-Item -LiteralPath $tmp -Destination $path -Force}
+finally{if(Test-Path -LiteralPath $tmp){Remove-Item -LiteralPath $tmp}}
+$v=Get-Values $path
+ConvertTo-Json -Compress -InputObject @(foreach($e in $all){
+$v["$($e.section)/$($e.key)"]})
+"""
+
 
 @contextlib.contextmanager
 def _create_tempdir():
@@ -56,14 +203,57 @@ def _create_tempfile(content=None):
         yield path
 
 
-def _get_ntp_peers(output):
+def _load_items(items, result_type=None):
+    """Get the items of a JSON query, as objects of the given type.
+
+    ConvertTo-Json emits a single object instead of an array
+    with a single item, so the items are always put in a list.
+    """
+    if items is None:
+        items = []
+    elif not isinstance(items, list):
+        items = [items]
+    if result_type is None:
+        return items
+    return [result_type(*(item.get(field) for field in result_type._fields))
+            for item in items]
+
+
+def _parse_json(output, result_type=None):
+    """Parse the output of a JSON query, which is empty for no items."""
+    output = output.strip()
+    return _load_items(json.loads(output) if output else None, result_type)
+
+
+def _ps_array(values):
+    """Get a PowerShell array with the given strings."""
+    return ",".join("'{}'".format(value.replace("'", "''"))
+                    for value in values)
+
+
+def _decode_content(data):
+    if data.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+        return data.decode("utf-16")
+    return data.decode("utf-8-sig", "replace")
+
+
+def _get_ntp_peers(entries):
     peers = []
-    for line in output.splitlines():
-        if not line.startswith("Peer: "):
-            continue
-        _, _, entry_peers = line.partition(":")
-        peers.extend(entry_peers.split(","))
-    return list(filter(None, map(str.strip, peers)))
+    for entry in entries:
+        peers.extend(entry.split(","))
+    return list(filter(None, [peer.strip() for peer in peers]))
+
+
+def _get_mtu(interfaces):
+    for interface in interfaces:
+        if "loopback" not in interface.alias.lower():
+            return str(interface.mtu)
+    return None
+
+
+def _get_os_version(output):
+    elems = output.split(".")
+    return list(map(int, elems))[:2]
 
 
 def escape_path(path):
@@ -123,79 +313,199 @@ def _get_nic_details(details):
     return NICDetails(**nic_details)
 
 
+def _resolve_install_layout(execute_function):
+    stdout = execute_function(_INSTALL_LAYOUT_QUERY,
+                              command_type=util.POWERSHELL).strip()
+    if not stdout:
+        raise exceptions.ArgusError(
+            'cloudbase-init installation dir not found')
+    layout = json.loads(stdout)
+    cbinit_dir = layout["cbinit_dir"]
+    python_dir = layout["python_dir"]
+    return InstallLayout(
+        cbinit_dir=cbinit_dir,
+        python_dir=python_dir,
+        conf_path=ntpath.join(cbinit_dir, "conf", "cloudbase-init.conf"),
+        site_packages=(ntpath.join(python_dir, "Lib", "site-packages")
+                       if python_dir else None),
+        registry_key=CBINIT_KEY if layout["native_key"] else CBINIT_KEY_X64)
+
+
+def get_install_layout(client):
+    """Get the :class:`InstallLayout` of cloudbase-init in the instance.
+
+    The layout is resolved with a single command and cached for the
+    instance, until :func:`invalidate_install_layout` is called.
+
+    :raises:
+        :class:`argus.exceptions.ArgusError` if cloudbase-init
+        isn't installed.
+    """
+    key = (client.hostname, client.instance_id)
+    with _INSTALL_LAYOUTS_LOCK:
+        layout = _INSTALL_LAYOUTS.get(key)
+    if layout is None:
+        def execute_function(cmd, command_type):
+            return client.run_command_with_retry(
+                cmd, command_type=command_type)[0]
+
+        layout = _resolve_install_layout(execute_function)
+        LOG.debug("Cloudbase-init is installed in %s", layout.cbinit_dir)
+        if client.instance_id is not None:
+            with _INSTALL_LAYOUTS_LOCK:
+                _INSTALL_LAYOUTS[key] = layout
+    return layout
+
+
+def invalidate_install_layout(client):
+    """Resolve the install layout again, after installing or replacing."""
+    with _INSTALL_LAYOUTS_LOCK:
+        _INSTALL_LAYOUTS.pop((client.hostname, client.instance_id), None)
+
+
 def get_cbinit_dir(execute_function):
     """Get the location of cloudbase-init from the instance."""
-    stdout = execute_function(
-        '(Get-CimInstance Win32_OperatingSystem).'
-        'OSArchitecture', command_type=util.POWERSHELL)
-    architecture = stdout.strip()
+    return _resolve_install_layout(execute_function).cbinit_dir
+
+
+def set_config_option(option, value, execute_function, conf_path=None):
+    """Set the value for the given *option* to *value*.
 
-    locations = [execute_function('powershell "$ENV:ProgramFiles"',
-                                  command_type=util.CMD)]
-    if architecture == '64-bit':
-        location = execute_function(
-            'powershell "${ENV:ProgramFiles(x86)}"',
-            command_type=util.CMD)
-        locations.append(location)
+    Use a :class:`ConfigEditor` for setting more options at once.
 
-    for location in locations:
-        location = location.strip()
-        _location = escape_path(location)
-        status = execute_function(
-            'Test-Path "{}\\Cloudbase` Solutions"'.format(
-                _location), command_type=util.POWERSHELL).strip().lower()
+    :param conf_path:
+        The path of the configuration file, which is looked up
+        when not given.
+    """
+    conf = conf_path or _resolve_install_layout(execute_function).conf_path
+    editor = ConfigEditor(execute_function, conf)
+    editor.set(option, value)
+    editor.apply()
 
-        if status == "true":
-            return ntpath.join(
-                location,
-                "Cloudbase Solutions",
-                "Cloudbase-Init"
-            )
 
-    raise exceptions.ArgusError('cloudbase-init installation dir not found')
+class ConfigEditor(object):
+    """Batch the changes of the cloudbase-init configuration file.
 
+    The options are collected with :meth:`set` and written all at once
+    by :meth:`apply`, with a single command. The options which are
+    already in their section are replaced, instead of being added again.
 
-def set_config_option(option, value, execute_function):
-    """Set the value for the given *option* to *value*."""
+    :param execute_function:
+        A function executing a command in the instance and
+        returning its output.
+    :param conf_path: The path of the configuration file.
+    """
 
-    line = "{} = {}".format(option, value)
-    cbdir = get_cbinit_dir(execute_function)
-    conf = ntpath.join(cbdir, "conf", "cloudbase-init.conf")
+    def __init__(self, execute_function, conf_path):
+        self._execute = execute_function
+        self._conf_path = conf_path
+        self._edits = collections.OrderedDict()
 
-    cmd = ('((Get-Content {0!r}) + {1!r}) |'
-           ' Set-Content {0!r}'.format(conf, line))
-    execute_function(cmd, command_type=util.POWERSHELL)
+    def __len__(self):
+        return len(self._edits)
+
+    def set(self, option, value, section=DEFAULT_SECTION):
+        """Set the given *option* to *value*, when the edits are applied."""
+        self._edits[(section, option)] = "{}".format(value).strip()
+
+    def apply(self):
+        """Apply the collected edits to the configuration file.
+
+        :returns: The number of edits which were applied.
+        :raises:
+            :class:`argus.exceptions.ArgusError` if the configuration
+            file doesn't hold the new values afterwards.
+        """
+        if not self._edits:
+            return 0
+        edits = [{"section": section, "key": option, "value": value}
+                 for (section, option), value in self._edits.items()]
+        cmd = "$path={};$edits={}\n{}".format(
+            _ps_array([self._conf_path]), _ps_array([json.dumps(edits)]),
+            _CONFIG_EDIT_SCRIPT)
+
+        started = time.time()
+        stdout = self._execute(cmd, command_type=util.POWERSHELL)
+        elapsed = time.time() - started
+
+        # The values which weren't read back are missing.
+        values = _parse_json(stdout) + [None] * len(edits)
+        wrong = ["[{}] {}".format(edit["section"], edit["key"])
+                 for edit, value in zip(edits, values)
+                 if value != edit["value"]]
+        if wrong:
+            raise exceptions.ArgusError(
+                "The options {} weren't set in {}.".format(
+                    ", ".join(wrong), self._conf_path))
+
+        # Each edit used to be a command of its own.
+        LOG.info("Applied %d configuration edits to %s in %.1f seconds, "
+                 "saving about %.1f seconds.", len(edits), self._conf_path,
+                 elapsed, elapsed * (len(edits) - 1))
+        self._edits.clear()
+        return len(edits)
 
 
 def get_python_dir(execute_function):
     """Find python directory from the cb-init installation."""
-    cbinit_dir = get_cbinit_dir(execute_function)
-    command = 'dir "{}" /b'.format(cbinit_dir)
-    stdout = execute_function(command,
-                              command_type=util.CMD).strip()
-    names = list(filter(None, stdout.splitlines()))
-    for name in names:
-        if "python" in name.lower():
-            return ntpath.join(cbinit_dir, name)
+    return _resolve_install_layout(execute_function).python_dir
 
 
 def get_cbinit_key(execute_function):
     """Get the proper registry key for Cloudbase-init."""
-    key = ("HKLM:SOFTWARE\\Cloudbase` Solutions\\"
-           "Cloudbase-init")
-    key_x64 = ("HKLM:SOFTWARE\\Wow6432Node\\Cloudbase` Solutions\\"
-               "Cloudbase-init")
-    cmd = 'Test-Path {}'.format(key)
-    result = execute_function(cmd, command_type=util.POWERSHELL)
-    if result.strip().lower() == "true":
-        return key
-    return key_x64
+    return _resolve_install_layout(execute_function).registry_key
 
 
 class InstanceIntrospection(base.CloudInstanceIntrospection):
-    """Utilities for introspecting a Windows instance."""
+    """Utilities for introspecting a Windows instance.
+
+    When the ``introspection_snapshot`` option is enabled, the facts
+    which don't depend on arguments are collected all at once, with
+    a single command, and reused until the instance is rebooted.
+    """
+
+    def __init__(self, conf, remote_client):
+        super(InstanceIntrospection, self).__init__(conf, remote_client)
+        self._snapshot = None
+        self._snapshot_generation = None
+
+    def invalidate_snapshot(self):
+        """Collect the facts again, the next time they are needed."""
+        self._snapshot = None
+
+    def get_snapshot(self):
+        """Get the facts about the instance, collected in a single call.
+
+        Return None if the snapshots are disabled.
+        """
+        if not self._conf.argus.introspection_snapshot:
+            return None
+        generation = self.remote_client.generation
+        if self._snapshot is None or self._snapshot_generation != generation:
+            code = util.get_resource('windows/get_snapshot.ps1')
+            remote_script = self.remote_client.get_script_path(code)
+            stdout, _, _ = self.remote_client.run_command_with_retry(
+                '{0} "{1}"'.format(remote_script,
+                                   self._conf.cloudbaseinit.group),
+                command_type=util.POWERSHELL_SCRIPT_BYPASS,
+                retry_exit_codes=True)
+            self._snapshot = json.loads(stdout)
+            self._snapshot_generation = generation
+            LOG.debug("Took a snapshot of the instance: %s", self._snapshot)
+        return self._snapshot
+
+    def _query(self, cmd, result_type=None):
+        """Run a PowerShell query which emits JSON and parse its items."""
+        stdout, _, _ = self.remote_client.run_command_with_retry(
+            cmd, command_type=util.POWERSHELL)
+        items = _parse_json(stdout, result_type)
+        LOG.debug("The query returned: %s", items)
+        return items
 
     def get_disk_size(self):
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return int(snapshot["disk_size"])
         cmd = ('(Get-WmiObject win32_logicaldisk | '
                'where -Property DeviceID -Match "C:").Size')
         return int(self.remote_client.run_command_verbose(
@@ -211,10 +521,12 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
         return bool(stdout)
 
     def get_instance_ntp_peers(self):
-        command = 'w32tm /query /peers'
-        stdout = self.remote_client.run_command_verbose(command,
-                                                        command_type=util.CMD)
-        return _get_ntp_peers(stdout)
+        # w32tm has no structured output, so only its peer lines
+        # are selected in the instance.
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return _get_ntp_peers(_load_items(snapshot["ntp_peers"]))
+        return _get_ntp_peers(self._query(_NTP_PEERS_QUERY))
 
     def get_instance_keys_path(self):
         cmd = 'echo %cd%'
@@ -230,70 +542,121 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
         return self.remote_client.run_command_verbose(
             cmd, command_type=util.POWERSHELL)
 
+    def get_files_content(self, paths, max_size=MAX_FILE_SIZE,
+                          max_total_size=MAX_TOTAL_SIZE):
+        """Get the content of multiple files, with a single command.
+
+        :param paths: The paths of the files, in the instance.
+        :param max_size:
+            The maximum number of bytes read from a file. The content
+            of the bigger files is truncated.
+        :param max_total_size:
+            The maximum number of bytes read from all the files. The
+            files after the one which reached it are truncated as well.
+        :returns:
+            A dictionary from the paths to the content of the files,
+            or None for the missing files.
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+        files = self._query(_FILES_CONTENT_QUERY.format(
+            paths=_ps_array(paths), max_size=max_size,
+            max_total_size=max_total_size))
+        contents = {}
+        for item in files:
+            if not item["exists"]:
+                contents[item["path"]] = None
+                continue
+            if item["truncated"]:
+                LOG.warning("The content of %s was truncated, it has "
+                            "%d bytes.", item["path"], item["size"])
+            contents[item["path"]] = _decode_content(
+                base64.b64decode(item["content"]))
+        return contents
+
+    def paths_exist(self, paths):
+        """Check if the given paths exist, with a single command.
+
+        :returns: A dictionary from the paths to whether they exist.
+        """
+        paths = list(paths)
+        if not paths:
+            return {}
+        exist = self._query(_PATHS_EXIST_QUERY.format(paths=_ps_array(paths)))
+        return dict(zip(paths, exist))
+
+    def list_locations(self, locations):
+        """List the content of multiple directories, with a single command.
+
+        :returns:
+            A dictionary from the directories to the names they
+            contain, or None for the missing directories.
+        """
+        locations = list(locations)
+        if not locations:
+            return {}
+        listings = self._query(_LIST_LOCATIONS_QUERY.format(
+            locations=_ps_array(locations)))
+        return {listing["location"]:
+                (None if listing["names"] is None
+                 else _load_items(listing["names"]))
+                for listing in listings}
+
     def get_userdata_executed_plugins(self):
         cmd = r'(Get-ChildItem -Path  C:\ *.txt).Count'
         stdout = self.remote_client.run_command_verbose(
             cmd, command_type=util.POWERSHELL)
         return int(stdout)
 
-    @staticmethod
-    def _parse_netsh_output(output):
-        output = output.strip()
-        blocks = re.split(r"SubInterface\s+(.*?)-{46}\s+", output,
-                          flags=re.DOTALL)
-        blocks = blocks[1:]  # empty space
-
-        interfaces = blocks[0::2]
-        content = blocks[1::2]
-        for interface, block in zip(interfaces, content):
-            interface = interface.strip()
-            mtu = re.search(r"MTU\s*:\s*(\d+)\s+", block)
-            if not mtu:
-                continue
-            if 'loopback' not in interface.lower():
-                yield mtu.group(1)
-
     def get_instance_mtu(self):
-        cmd = 'netsh interface ipv4 show subinterfaces level=verbose'
-        stdout = self.remote_client.run_command_verbose(
-            cmd, command_type=util.CMD)
-        return next(self._parse_netsh_output(stdout), None)
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return _get_mtu(_load_items(snapshot["interfaces"], Interface))
+        return _get_mtu(self._query(_INTERFACES_QUERY, Interface))
 
     def get_cloudbaseinit_traceback(self):
         code = util.get_resource('windows/get_traceback.ps1')
-        remote_script = "C:\\{}.ps1".format(util.rand_name())
-        with _create_tempfile(content=code) as tmp:
-            self.remote_client.copy_file(tmp, remote_script)
-            stdout = self.remote_client.run_command_verbose(
-                remote_script,
-                command_type=util.POWERSHELL)
-            return stdout.strip()
+        remote_script = self.remote_client.get_script_path(code)
+        remote_output = "C:\\{}.txt".format(util.rand_name())
+        with _create_tempfile() as tmp:
+            try:
+                self.remote_client.run_command_with_retry(
+                    "& '{}' | Out-File -FilePath '{}' -Encoding UTF8 "
+                    "-Width 4096".format(remote_script, remote_output),
+                    command_type=util.POWERSHELL)
+                self.remote_client.download_file(remote_output, tmp)
+            finally:
+                self.remote_client.run_remote_cmd(
+                    "Remove-Item -LiteralPath '{}' -Force "
+                    "-ErrorAction SilentlyContinue".format(remote_output),
+                    command_type=util.POWERSHELL)
+            with open(tmp, 'rb') as stream:
+                return stream.read().decode('utf-8-sig').strip()
 
     def _file_exist(self, filepath):
-        stdout = self.remote_client.run_command_verbose(
-            'Test-Path {}'.format(filepath), command_type=util.POWERSHELL)
-        return stdout.strip() == 'True'
+        return self.paths_exist([filepath])[filepath]
 
     def instance_exe_script_executed(self):
         return self._file_exist("C:\\Scripts\\exe.output")
 
     def get_group_members(self, group):
-        cmd = "net localgroup {}".format(group)
-        std_out = self.remote_client.run_command_verbose(
-            cmd, command_type=util.CMD)
-        member_search = re.search(
-            r"Members\s+-+\s+(.*?)The\s+command",
-            std_out, re.MULTILINE | re.DOTALL)
-        if not member_search:
-            raise ValueError('Unable to get members.')
-
-        return list(filter(None, member_search.group(1).split()))
+        snapshot = self.get_snapshot()
+        if (snapshot is not None and snapshot["group"] == group and
+                snapshot["group_members"] is not None):
+            members = _load_items(snapshot["group_members"], Account)
+        else:
+            # The query fails if the group doesn't exist.
+            members = self._query(_GROUP_MEMBERS_QUERY.format(group=group),
+                                  Account)
+        return [member.name for member in members]
 
     def list_location(self, location):
-        command = "dir {} /b".format(location)
-        stdout = self.remote_client.run_command_verbose(
-            command, command_type=util.CMD)
-        return list(filter(None, stdout.splitlines()))
+        names = self.list_locations([location])[location]
+        if names is None:
+            raise exceptions.ArgusError(
+                "Location {} doesn't exist.".format(location))
+        return names
 
     def get_service_triggers(self, service):
         """Get the triggers of the given service.
@@ -301,15 +664,20 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
         Return a tuple of two elements, where the first is the start
         trigger and the second is the end trigger.
         """
-        command = "sc qtriggerinfo {}".format(service)
-        stdout = self.remote_client.run_command_verbose(
-            command, command_type=util.CMD)
-        match = re.search(r"START SERVICE\s+(.*?):.*?STOP SERVICE\s+(.*?):",
-                          stdout, re.DOTALL)
-        if not match:
+        triggers = self._query(
+            _SERVICE_TRIGGERS_QUERY.format(service=service), ServiceTrigger)
+        names = {}
+        for trigger in triggers:
+            names.setdefault(trigger.action, TRIGGER_TYPES.get(
+                trigger.type, str(trigger.type)))
+        if not {TRIGGER_ACTION_START, TRIGGER_ACTION_STOP} <= set(names):
             raise ValueError("Unable to get the triggers for the "
                              "given service.")
-        return (match.group(1).strip(), match.group(2).strip())
+        return (names[TRIGGER_ACTION_START], names[TRIGGER_ACTION_STOP])
+
+    def get_licenses(self):
+        """Get the licensed products, with their license status."""
+        return self._query(_LICENSES_QUERY, License)
 
     def get_instance_os_version(self):
         """Get the version of the underlying OS
@@ -317,11 +685,13 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
          Return a tuple of two elements, the major and the minor
          version.
         """
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return _get_os_version(snapshot["os_version"])
         cmd = "(Get-CimInstance Win32_OperatingSystem).Version"
         stdout = self.remote_client.run_command_verbose(
             cmd, command_type=util.POWERSHELL)
-        elems = stdout.split(".")
-        return list(map(int, elems))[:2]
+        return _get_os_version(stdout)
 
     def get_cloudconfig_executed_plugins(self):
         expected = {
@@ -329,20 +699,25 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
             'gzip', 'gzip_1',
             'gzip_base64', 'gzip_base64_1', 'gzip_base64_2'
         }
-        files = {}
-        for basefile in expected:
-            path = ntpath.join("C:\\", basefile)
-            content = self.get_instance_file_content(path)
-            files[basefile] = content.strip()
-        return files
+        paths = {ntpath.join("C:\\", basefile): basefile
+                 for basefile in expected}
+        contents = self.get_files_content(paths)
+        return {paths[path]: content and content.strip()
+                for path, content in contents.items()}
 
     def get_timezone(self):
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return snapshot["timezone"]
         command = "[System.TimeZone]::CurrentTimeZone.StandardName"
         stdout = self.remote_client.run_command_verbose(
             "{}".format(command), command_type=util.POWERSHELL)
         return stdout
 
     def get_instance_hostname(self):
+        snapshot = self.get_snapshot()
+        if snapshot is not None:
+            return snapshot["hostname"].lower().strip()
         command = "hostname"
         stdout = self.remote_client.run_command_verbose(
             command, command_type=util.CMD)
@@ -390,10 +765,8 @@ class InstanceIntrospection(base.CloudInstanceIntrospection):
 
     def get_user_flags(self, user):
         code = util.get_resource('windows/get_user_flags.ps1')
-        remote_script = "C:\\{}.ps1".format(util.rand_name())
-        with _create_tempfile(content=code) as tmp:
-            self.remote_client.copy_file(tmp, remote_script)
-            stdout = self.remote_client.run_command_verbose(
-                "{0} {1}".format(remote_script, user),
-                command_type=util.POWERSHELL_SCRIPT_BYPASS)
-            return stdout.strip()
+        remote_script = self.remote_client.get_script_path(code)
+        stdout = self.remote_client.run_command_verbose(
+            "{0} {1}".format(remote_script, user),
+            command_type=util.POWERSHELL_SCRIPT_BYPASS)
+        return stdout.strip()
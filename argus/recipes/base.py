@@ -49,22 +49,37 @@ class BaseRecipe(object):
         self._backend = backend
 
     def _execute(self, cmd, count=RETRY_COUNT, delay=RETRY_DELAY,
-                 command_type=None):
-        """Execute until success and return only the standard output."""
+                 command_type=None, policy=None, retry_exit_codes=False,
+                 on_line=None):
+        """Execute until success and return only the standard output.
+
+        :param policy:
+            A :class:`argus.retry.RetryPolicy` used instead of
+            the one given by `count` and `delay`.
+        :param retry_exit_codes:
+            Retry the command when it fails, not only on transport
+            errors. Either True or a list of exit codes.
+        :param on_line:
+            A callable receiving each line of the output, while the
+            command is still running.
+        """
 
         # A positive exit code will trigger the failure
         # in the underlying methods as an `ArgusError`.
         # Also, if the retrying limit is reached, `ArgusTimeoutError`
         # will be raised.
         return self._backend.remote_client.run_command_with_retry(
-            cmd, count=count, delay=delay, command_type=command_type)[0]
+            cmd, count=count, delay=delay, command_type=command_type,
+            policy=policy, retry_exit_codes=retry_exit_codes,
+            on_line=on_line)[0]
 
     def _execute_until_condition(self, cmd, cond, count=RETRY_COUNT,
-                                 delay=RETRY_DELAY, command_type=None):
+                                 delay=RETRY_DELAY, command_type=None,
+                                 policy=None):
         """Execute a command until the condition is met without returning."""
         self._backend.remote_client.run_command_until_condition(
             cmd, cond, retry_count=count,
-            delay=delay, command_type=command_type)
+            delay=delay, command_type=command_type, policy=policy)
 
     @abc.abstractmethod
     def prepare(self, **kwargs):
@@ -40,6 +40,9 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
     * get an install script for CloudbaseInit
     * installs CloudbaseInit
     * waits for the finalization of the installation.
+
+    When the backend has a snapshot of the same installation, the
+    instance is rebuilt from it instead, skipping the installation.
     """
 
     @abc.abstractmethod
@@ -68,6 +71,9 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
     def pre_sysprep(self):
         """Run finalization code before sysprepping."""
 
+    def apply_config(self):
+        """Apply the configuration changes made by :meth:`pre_sysprep`."""
+
     @abc.abstractmethod
     def sysprep(self):
         """Do the final steps after installing cloudbaseinit.
@@ -84,6 +90,38 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
     def replace_code(self):
         """Do whatever is necessary to replace the code for cloudbaseinit."""
 
+    def get_installation(self, service_type):
+        """Describe the installation of cloudbaseinit.
+
+        The instances with the same installation are interchangeable
+        before :meth:`pre_sysprep`, so they share their snapshots.
+        """
+        return {
+            "image_ref": self._conf.openstack.image_ref,
+            "build": self._conf.argus.build,
+            "arch": self._conf.argus.arch,
+            "patch_install": self._conf.argus.patch_install,
+            "git_command": self._conf.argus.git_command,
+            "service_type": service_type,
+        }
+
+    def install(self, service_type):
+        """Install cloudbaseinit, unless the instance has a snapshot of it."""
+        installation = self.get_installation(service_type)
+        if self._backend.restore_snapshot(installation):
+            self.wait_for_boot_completion()
+            LOG.info("Restored the installation from a snapshot.")
+            return
+
+        self.wait_for_boot_completion()
+        self.execution_prologue()
+        self.get_installation_script()
+        self.install_cbinit(service_type)
+        self.replace_install()
+        self.replace_code()
+        if self._backend.save_snapshot(installation):
+            self.wait_for_boot_completion()
+
     def prepare(self, service_type=None, **kwargs):
         """Prepare the underlying instance.
 
@@ -95,13 +133,9 @@ class BaseCloudbaseinitRecipe(base.BaseRecipe):
         * wait until the instance is up and running.
         """
         LOG.info("Preparing instance...")
-        self.wait_for_boot_completion()
-        self.execution_prologue()
-        self.get_installation_script()
-        self.install_cbinit(service_type)
-        self.replace_install()
-        self.replace_code()
+        self.install(service_type)
         self.pre_sysprep()
+        self.apply_config()
         if self._conf.argus.pause:
             six.moves.input("Press Enter to continue...")
 
@@ -36,6 +36,29 @@ _CBINIT_REPO = "https://github.com/openstack/cloudbase-init"
 class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
     """Recipe for preparing a Windows instance."""
 
+    _config_editor = None
+
+    @property
+    def _config(self):
+        """The :class:`ConfigEditor` of the cloudbase-init configuration.
+
+        The options set by :meth:`pre_sysprep` are written all at once
+        by :meth:`apply_config`.
+        """
+        if self._config_editor is None:
+            self._config_editor = introspection.ConfigEditor(
+                self._execute, self._install_layout.conf_path)
+        return self._config_editor
+
+    @property
+    def _install_layout(self):
+        """The :class:`InstallLayout` of cloudbase-init in the instance."""
+        return introspection.get_install_layout(self._backend.remote_client)
+
+    def _invalidate_install_layout(self):
+        introspection.invalidate_install_layout(self._backend.remote_client)
+        self._config_editor = None
+
     def wait_for_boot_completion(self):
         LOG.info("Waiting for first boot completion...")
         self._backend.remote_client.manager.wait_boot_completion()
@@ -53,14 +76,19 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
 
     def install_cbinit(self, service_type):
         """Proceed on checking if cloudbase-init should be installed."""
+        # The disk might have changed since the layout was cached,
+        # for instance by a rescue, so look in the instance again.
+        self._invalidate_install_layout()
         try:
-            cbdir = introspection.get_cbinit_dir(self._execute)
+            cbdir = self._install_layout.cbinit_dir
         except exceptions.ArgusError:
             self._backend.remote_client.manager.install_cbinit(service_type)
+            self._invalidate_install_layout()
             self._grab_cbinit_installation_log()
         else:
             # If the directory already exists, we won't be installing Cb-init.
-            LOG.info("Cloudbase-init is already installed, skipping installation.")
+            LOG.info("Cloudbase-init is already installed in %s, "
+                     "skipping installation.", cbdir)
 
     def _grab_cbinit_installation_log(self):
         """Obtain the installation logs."""
@@ -70,13 +98,12 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
                         "the log will not be grabbed.")
             return
 
-        content = self._backend.remote_client.read_file("C:\\installation.log")
         log_template = "installation-{}.log".format(
             self._backend.instance_server()['id'])
 
         path = os.path.join(self._conf.argus.output_directory, log_template)
-        with open(path, 'w') as stream:
-            stream.write(content)
+        self._backend.remote_client.download_file("C:\\installation.log",
+                                                  path)
 
     def replace_install(self):
         """Replace the cb-init installed files with the downloaded ones.
@@ -94,7 +121,7 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         LOG.debug("Download and extract installation bundle.")
         if link.startswith("\\\\"):
             cmd = 'copy "{}" "C:\\install.zip"'.format(link)
-            self._execute(cmd, command_type=util.CMD)
+            self._execute(cmd, command_type=util.CMD, retry_exit_codes=True)
         else:
             location = r'C:\install.zip'
             self._backend.remote_client.manager.download(
@@ -108,9 +135,10 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         self._execute(cmd, command_type=util.POWERSHELL)
 
         LOG.debug("Replace old files with the new ones.")
-        cbdir = introspection.get_cbinit_dir(self._execute)
+        cbdir = self._install_layout.cbinit_dir
         self._execute('xcopy /y /e /q "C:\\install\\Cloudbase-Init"'
                       ' "{}"'.format(cbdir), command_type=util.CMD)
+        self._invalidate_install_layout()
 
     def replace_code(self):
         """Replace the code of cloudbaseinit."""
@@ -122,15 +150,12 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
 
         LOG.info("Getting cloudbase-init location...")
         # Get cb-init python location.
-        python_dir = introspection.get_python_dir(self._execute)
+        layout = self._install_layout
+        python_dir = layout.python_dir
 
         # Remove everything from the cloudbaseinit installation.
         LOG.info("Removing recursively cloudbaseinit...")
-        cloudbaseinit = ntpath.join(
-            python_dir,
-            "Lib",
-            "site-packages",
-            "cloudbaseinit")
+        cloudbaseinit = ntpath.join(layout.site_packages, "cloudbaseinit")
         self._execute('rmdir "{}" /S /q'.format(cloudbaseinit),
                       command_type=util.CMD)
 
@@ -155,7 +180,9 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         # Autoinstall packages from the new requirements.txt
         python = ntpath.join(python_dir, "python.exe")
         command = '"{}" -m pip install -r C:\\cloudbaseinit\\requirements.txt'
-        self._execute(command.format(python), command_type=util.CMD)
+        self._execute(command.format(python), command_type=util.CMD,
+                      retry_exit_codes=True, on_line=LOG.info)
+        self._invalidate_install_layout()
 
     def pre_sysprep(self):
         """Disable first_logon_behaviour for testing purposes.
@@ -165,17 +192,14 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         so this is always disabled, excepting tests which sets
         it manual to whatever they want.
         """
-        introspection.set_config_option(
-            option="first_logon_behaviour", value="no",
-            execute_function=self._execute)
+        self._config.set("first_logon_behaviour", "no")
 
         # Patch the installation of cloudbaseinit in order to create
         # a file when the execution ends. We're doing this instead of
         # monitoring the service, because on some OSes, just checking
         # if the service is stopped leads to errors, due to the
         # fact that the service starts later on.
-        python_dir = introspection.get_python_dir(self._execute)
-        cbinit = ntpath.join(python_dir, 'Lib', 'site-packages',
+        cbinit = ntpath.join(self._install_layout.site_packages,
                              'cloudbaseinit')
 
         # Get the shell patching script and patch the installation.
@@ -187,6 +211,10 @@ class CloudbaseinitRecipe(base.BaseCloudbaseinitRecipe):
         # Prepare Something specific for the OS
         self._backend.remote_client.manager.specific_prepare()
 
+    def apply_config(self):
+        """Write the options set by :meth:`pre_sysprep`, with one command."""
+        self._config.apply()
+
     def sysprep(self):
         """Prepare the instance for the actual tests, by running sysprep."""
         LOG.info("Running sysprep...")
@@ -245,10 +273,7 @@ class BaseNextLogonRecipe(CloudbaseinitRecipe):
     def pre_sysprep(self):
         super(BaseNextLogonRecipe, self).pre_sysprep()
 
-        introspection.set_config_option(
-            option="first_logon_behaviour",
-            value=self.behaviour,
-            execute_function=self._execute)
+        self._config.set("first_logon_behaviour", self.behaviour)
 
 
 class AlwaysChangeLogonPasswordRecipe(BaseNextLogonRecipe):
@@ -275,9 +300,7 @@ class CloudbaseinitMockServiceRecipe(CloudbaseinitRecipe):
 
         # Append service IP as a config option.
         address = self.pattern.format(util.get_local_ip())
-        introspection.set_config_option(option=self.config_entry,
-                                        value=address,
-                                        execute_function=self._execute)
+        self._config.set(self.config_entry, address)
 
 
 class CloudbaseinitEC2Recipe(CloudbaseinitMockServiceRecipe):
@@ -296,14 +319,15 @@ class CloudbaseinitCloudstackRecipe(CloudbaseinitMockServiceRecipe):
     def pre_sysprep(self):
         super(CloudbaseinitCloudstackRecipe, self).pre_sysprep()
 
-        python_dir = introspection.get_python_dir(self._execute)
-        cbinit = ntpath.join(python_dir, 'Lib', 'site-packages',
-                             'cloudbaseinit')
+        layout = self._install_layout
+        python_dir = layout.python_dir
+        cbinit = ntpath.join(layout.site_packages, 'cloudbaseinit')
 
         # Install mock
         python = ntpath.join(python_dir, "python.exe")
         command = '"{}" -m pip install mock'
-        self._execute(command.format(python), command_type=util.CMD)
+        self._execute(command.format(python), command_type=util.CMD,
+                      retry_exit_codes=True)
 
         # Get the cloudstack patching script and patch the installation.
         resource_location = "windows/patch_cloudstack.ps1"
@@ -329,8 +353,7 @@ class CloudbaseinitMaasRecipe(CloudbaseinitMockServiceRecipe):
         )
 
         for field in required_fields:
-            introspection.set_config_option(option=field, value="secret",
-                                            execute_function=self._execute)
+            self._config.set(field, "secret")
 
 
 class CloudbaseinitWinrmRecipe(CloudbaseinitCreateUserRecipe):
@@ -338,13 +361,12 @@ class CloudbaseinitWinrmRecipe(CloudbaseinitCreateUserRecipe):
 
     def pre_sysprep(self):
         super(CloudbaseinitWinrmRecipe, self).pre_sysprep()
-        introspection.set_config_option(
-            option="plugins",
-            value="cloudbaseinit.plugins.windows.winrmcertificateauth."
-                  "ConfigWinRMCertificateAuthPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmlistener."
-                  "ConfigWinRMListenerPlugin",
-            execute_function=self._execute)
+        self._config.set(
+            "plugins",
+            "cloudbaseinit.plugins.windows.winrmcertificateauth."
+            "ConfigWinRMCertificateAuthPlugin,"
+            "cloudbaseinit.plugins.windows.winrmlistener."
+            "ConfigWinRMListenerPlugin")
 
 
 class CloudbaseinitHTTPRecipe(CloudbaseinitMockServiceRecipe):
@@ -360,19 +382,18 @@ class CloudbaseinitKeysRecipe(CloudbaseinitHTTPRecipe,
 
     def pre_sysprep(self):
         super(CloudbaseinitKeysRecipe, self).pre_sysprep()
-        introspection.set_config_option(
-            option="plugins",
-            value="cloudbaseinit.plugins.windows.createuser."
-                  "CreateUserPlugin,"
-                  "cloudbaseinit.plugins.windows.setuserpassword."
-                  "SetUserPasswordPlugin,"
-                  "cloudbaseinit.plugins.common.sshpublickeys."
-                  "SetUserSSHPublicKeysPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmlistener."
-                  "ConfigWinRMListenerPlugin,"
-                  "cloudbaseinit.plugins.windows.winrmcertificateauth."
-                  "ConfigWinRMCertificateAuthPlugin",
-            execute_function=self._execute)
+        self._config.set(
+            "plugins",
+            "cloudbaseinit.plugins.windows.createuser."
+            "CreateUserPlugin,"
+            "cloudbaseinit.plugins.windows.setuserpassword."
+            "SetUserPasswordPlugin,"
+            "cloudbaseinit.plugins.common.sshpublickeys."
+            "SetUserSSHPublicKeysPlugin,"
+            "cloudbaseinit.plugins.windows.winrmlistener."
+            "ConfigWinRMListenerPlugin,"
+            "cloudbaseinit.plugins.windows.winrmcertificateauth."
+            "ConfigWinRMCertificateAuthPlugin")
 
 
 class CloudbaseinitLocalScriptsRecipe(CloudbaseinitRecipe):
@@ -392,7 +413,7 @@ class CloudbaseinitImageRecipe(CloudbaseinitRecipe):
     """Calibrate already sys-prepared cloudbase-init images."""
 
     def wait_cbinit_finalization(self):
-        cbdir = introspection.get_cbinit_dir(self._execute)
+        cbdir = self._install_layout.cbinit_dir
         paths = [ntpath.join(cbdir, "log", name)
                  for name in ["cloudbase-init-unattend.log",
                               "cloudbase-init.log"]]
@@ -0,0 +1,37 @@
+param
+(
+    [string]$group = 'Administrators'
+)
+
+$ErrorActionPreference = "Stop"
+
+# Collect the facts checked by the tests, in a single call.
+$os = Get-CimInstance Win32_OperatingSystem
+$disk = Get-CimInstance Win32_LogicalDisk -Filter "DeviceID='C:'"
+$groupInstance = Get-CimInstance Win32_Group -Filter "LocalAccount=True AND Name='$group'"
+
+$interfaces = @(Get-NetIPInterface -AddressFamily IPv4 | Sort-Object InterfaceIndex |
+    Select-Object @{n='alias';e={$_.InterfaceAlias}},
+                  @{n='index';e={$_.InterfaceIndex}},
+                  @{n='mtu';e={$_.NlMtu}})
+$peers = @(w32tm /query /peers | Where-Object {$_ -like 'Peer: *'} |
+    ForEach-Object {$_.Substring(6)})
+# The members are null if the group doesn't exist.
+$members = $null
+if ($groupInstance) {
+    $members = @(Get-CimAssociatedInstance -InputObject $groupInstance -Association Win32_GroupUser |
+        Select-Object @{n='name';e={$_.Name}}, @{n='domain';e={$_.Domain}})
+}
+
+$facts = @{
+    "disk_size" = [string]$disk.Size;
+    "hostname" = [string](hostname);
+    "ntp_peers" = $peers;
+    "interfaces" = $interfaces;
+    "timezone" = [System.TimeZone]::CurrentTimeZone.StandardName;
+    "os_version" = [string]$os.Version;
+    "group" = $group;
+    "group_members" = $members
+}
+
+ConvertTo-Json -Compress -Depth 3 $facts
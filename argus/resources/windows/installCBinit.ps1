@@ -1,7 +1,8 @@
 param
 (
     [string]$serviceType = 'http',
-    [string]$installer = 'CloudbaseInitSetup_Beta_x64.msi'
+    [string]$installer = 'CloudbaseInitSetup_Beta_x64.msi',
+    [string]$installerUrl = ''
 )
 
 Import-Module C:\common.psm1
@@ -65,6 +66,9 @@ try {
 
     $CloudbaseInitMsiPath = "$ENV:Temp\$installer"
     $CloudbaseInitMsiUrl = "http://www.cloudbase.it/downloads/$installer"
+    if ($installerUrl) {
+        $CloudbaseInitMsiUrl = $installerUrl
+    }
     $CloudbaseInitMsiLog = "C:\\installation.log"
 
     (new-object System.Net.WebClient).DownloadFile($CloudbaseInitMsiUrl, $CloudbaseInitMsiPath)
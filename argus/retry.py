@@ -0,0 +1,289 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Retry policies, deciding when and how long to wait between attempts.
+
+A policy is shared by any number of calls, each of them getting its
+own :class:`RetryState` through :meth:`RetryPolicy.begin`::
+
+    state = policy.begin("my command")
+    while True:
+        if try_something():
+            break
+        if not state.wait():
+            raise exceptions.ArgusTimeoutError("...")
+"""
+
+import collections
+import random
+import socket
+import threading
+import time
+
+import requests
+from winrm import exceptions as winrm_exceptions
+
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+# The first retry happens quickly, since most of the conditions
+# which are polled are met shortly after the first check.
+MIN_DELAY = 0.5
+MULTIPLIER = 2
+JITTER = 0.2
+
+# The classes of errors.
+TRANSPORT = "transport"
+AUTH = "auth"
+TIMEOUT = "timeout"
+COMMAND = "command"
+CIRCUIT_OPEN = "circuit_open"
+UNKNOWN = "unknown"
+
+# The classes of errors which are worth retrying, since they
+# usually go away, for instance when the instance finishes booting.
+RETRYABLE = frozenset((TRANSPORT, AUTH, TIMEOUT))
+
+# Errors which tell that the host can't be reached, or that the
+# connection to it was lost. Only these count as failures of a host.
+TRANSPORT_ERRORS = (
+    socket.error,
+    requests.ConnectionError,
+    requests.Timeout,
+    winrm_exceptions.WinRMTransportError,
+)
+# Errors which tell that the credentials were refused. The password
+# might not be set yet, while the instance boots.
+AUTH_ERRORS = (
+    winrm_exceptions.InvalidCredentialsError,
+)
+# Errors after which a WinRM shell or session can't be used anymore.
+SESSION_ERRORS = TRANSPORT_ERRORS + AUTH_ERRORS
+
+# Errors of a single attempt which ran out of time. The exhaustion of
+# a retry loop, a plain ArgusTimeoutError, isn't retried, otherwise
+# the budgets of the nested retry loops would multiply.
+_TIMEOUT_ERRORS = (
+    exceptions.ArgusCommandTimeout,
+    getattr(winrm_exceptions, "WinRMOperationTimeoutError", ()),
+)
+
+_STATS = collections.Counter()
+_STATS_LOCK = threading.Lock()
+
+
+def get_stats():
+    """Get the retry counters, so far.
+
+    Besides the number of calls, attempts and the time slept,
+    this tells how many calls gave up early, since their error
+    wasn't worth retrying, and the time saved by doing so.
+    """
+    with _STATS_LOCK:
+        return {key: _STATS[key]
+                for key in ("calls", "attempts", "sleep_time",
+                            "permanent_failures", "saved_time")}
+
+
+def classify(exc):
+    """Get the class of the given error."""
+    if isinstance(exc, exceptions.ArgusCommandError):
+        return COMMAND
+    if isinstance(exc, AUTH_ERRORS):
+        return AUTH
+    if isinstance(exc, _TIMEOUT_ERRORS):
+        return TIMEOUT
+    if isinstance(exc, TRANSPORT_ERRORS):
+        return TRANSPORT
+    if isinstance(exc, exceptions.ArgusCircuitOpenError):
+        # The host is known to be dead, so the call fails right away,
+        # with the original cause, instead of waiting for its budget.
+        return CIRCUIT_OPEN
+    if isinstance(exc, winrm_exceptions.WinRMError):
+        # The other WinRM faults go away as well, while the
+        # services of the instance are starting.
+        return TRANSPORT
+    return UNKNOWN
+
+
+def is_retryable(exc, retry_exit_codes=False):
+    """Check if the command which raised the given error can be retried.
+
+    :param retry_exit_codes:
+        True if failed commands can be retried, or a list of the exit
+        codes which can be retried.
+    """
+    kind = classify(exc)
+    if kind == COMMAND and retry_exit_codes:
+        return (retry_exit_codes is True or
+                exc.exit_code in retry_exit_codes)
+    return kind in RETRYABLE
+
+
+class RetryPolicy(object):
+    """An exponential backoff policy, with jitter.
+
+    :param min_delay:
+        The number of seconds to wait before the first retry.
+    :param max_delay:
+        The maximum number of seconds to wait between two attempts.
+    :param multiplier:
+        The factor by which the delay grows after each attempt.
+    :param jitter:
+        The fraction of each delay which is randomized, so that
+        concurrent callers don't retry in lockstep.
+    :param max_attempts:
+        The maximum number of attempts, ``None`` for no limit.
+    :param max_sleep:
+        The maximum number of seconds spent sleeping between
+        attempts, ``None`` for no limit.
+    :param deadline:
+        The maximum number of seconds since the first attempt,
+        after which no new attempt is made, ``None`` for no limit.
+    """
+
+    def __init__(self, min_delay=MIN_DELAY, max_delay=util.RETRY_DELAY,
+                 multiplier=MULTIPLIER, jitter=JITTER, max_attempts=None,
+                 max_sleep=None, deadline=None):
+        self.min_delay = min(min_delay, max_delay)
+        self.max_delay = max_delay
+        self.multiplier = multiplier
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.max_sleep = max_sleep
+        self.deadline = deadline
+
+    @classmethod
+    def from_count(cls, count, delay, **kwargs):
+        """Get a policy equivalent to retrying `count` times every `delay`.
+
+        The time budget of the fixed delays is kept, but the attempts
+        are made sooner, up to `delay` seconds apart. A falsy `count`
+        means retrying forever.
+        """
+        max_sleep = count * delay if count and count > 0 else None
+        return cls(max_delay=delay, max_sleep=max_sleep, **kwargs)
+
+    def delay(self, attempt):
+        """Get the delay after the given attempt, starting from 1."""
+        delay = min(self.max_delay,
+                    self.min_delay * self.multiplier ** (attempt - 1))
+        return delay * (1 - self.jitter * random.random())
+
+    def begin(self, description=None):
+        """Start a new call, which is retried according to this policy."""
+        return RetryState(self, description)
+
+
+class RetryState(object):
+    """The retry state of a single call.
+
+    :param policy: The :class:`RetryPolicy` of the call.
+    :param description: What is retried, used for logging.
+    """
+
+    def __init__(self, policy, description=None):
+        self.policy = policy
+        self.description = description
+        self.attempts = 1
+        self.sleep_time = 0
+        self._started = time.time()
+        with _STATS_LOCK:
+            _STATS["calls"] += 1
+            _STATS["attempts"] += 1
+
+    @property
+    def elapsed(self):
+        return time.time() - self._started
+
+    def _exhausted(self):
+        policy = self.policy
+        if policy.max_attempts and self.attempts >= policy.max_attempts:
+            return True
+        if policy.max_sleep is not None and (
+                self.sleep_time >= policy.max_sleep):
+            return True
+        if policy.deadline is not None and self.elapsed >= policy.deadline:
+            return True
+        return False
+
+    def wait(self):
+        """Sleep before the next attempt.
+
+        :returns:
+            False if there shouldn't be another attempt, True otherwise.
+        """
+        if self._exhausted():
+            LOG.debug("Giving up on %s after %d attempts and %.1f seconds "
+                      "of sleep.", self.description, self.attempts,
+                      self.sleep_time)
+            return False
+
+        policy = self.policy
+        delay = policy.delay(self.attempts)
+        if policy.max_sleep is not None:
+            delay = min(delay, policy.max_sleep - self.sleep_time)
+        if policy.deadline is not None:
+            delay = min(delay, policy.deadline - self.elapsed)
+        delay = max(delay, 0)
+
+        time.sleep(delay)
+        self.attempts += 1
+        self.sleep_time += delay
+        with _STATS_LOCK:
+            _STATS["attempts"] += 1
+            _STATS["sleep_time"] += delay
+        return True
+
+    def remaining(self):
+        """Estimate the number of seconds left to sleep by this call.
+
+        :returns: The estimate, or None if the policy is unbounded.
+        """
+        policy = self.policy
+        estimates = []
+        if policy.max_sleep is not None:
+            estimates.append(policy.max_sleep - self.sleep_time)
+        if policy.deadline is not None:
+            estimates.append(policy.deadline - self.elapsed)
+        if policy.max_attempts:
+            estimates.append(sum(
+                policy.delay(attempt)
+                for attempt in range(self.attempts, policy.max_attempts)))
+        if not estimates:
+            return None
+        return max(min(estimates), 0)
+
+    def give_up(self):
+        """Record that the call stops early, on an error not worth retrying."""
+        saved = self.remaining() or 0
+        with _STATS_LOCK:
+            _STATS["permanent_failures"] += 1
+            _STATS["saved_time"] += saved
+        LOG.debug("Not retrying %s, since the error is permanent, saving "
+                  "up to %.1f seconds.", self.description, saved)
+
+    def done(self):
+        """Record the end of a successful call."""
+        if self.attempts > 1:
+            LOG.debug("%s succeeded after %d attempts and %.1f seconds of "
+                      "sleep.", self.description, self.attempts,
+                      self.sleep_time)
+
+
+DEFAULT = RetryPolicy.from_count(util.RETRY_COUNT, util.RETRY_DELAY)
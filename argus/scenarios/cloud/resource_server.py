@@ -0,0 +1,379 @@
+# Copyright 2016 Cloudbase Solutions Srl
+# All Rights Reserved.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""A server on the host, for the downloads of the instances.
+
+The server runs next to the mocked metadata services and serves:
+
+* ``/resources/<location>``, the resources of argus, straight from
+  the :mod:`argus.resources` package;
+* ``/cache/<signature>/<encoded URL>``, the remote files given to
+  :meth:`ResourceServer.cache_url`, through a read-through
+  :class:`DiskCache`, so each file is fetched from the internet
+  once, instead of once for each instance.
+
+The cached URLs are signed with a secret kept in the cache directory,
+so the server fetches only the files which argus asked for, instead
+of any URL it receives.
+
+Both support conditional requests with ETags. When the server is
+enabled in the configuration, the downloads of the action managers
+are rewritten to go through it.
+"""
+
+import atexit
+import binascii
+import contextlib
+import errno
+import hashlib
+import hmac
+import json
+import os
+import tempfile
+import threading
+import time
+
+import requests
+import six
+
+from argus.scenarios.cloud import service_mock
+from argus.scenarios.cloud import windows as cloud_windows
+from argus import exceptions
+from argus import util
+
+
+LOG = util.get_logger()
+
+# The number of seconds a cached file is served without
+# checking whether it changed upstream.
+MAX_AGE = 60 * 60
+FETCH_TIMEOUT = 60
+CHUNK_SIZE = 64 * 1024
+# The number of seconds to wait for a server already running.
+PING_TIMEOUT = 5
+
+_METADATA_SUFFIX = ".json"
+_TEMP_PREFIX = ".tmp-"
+_SECRET_NAME = ".secret"
+
+_SERVER = None
+_SERVER_LOCK = threading.Lock()
+
+
+class DiskCache(object):
+    """A read-through cache of remote files, bounded in size.
+
+    The least recently used files are evicted when the total size
+    of the cached files exceeds the limit.
+
+    :param directory: The directory of the cached files.
+    :param max_size: The maximum size of the cached files, in bytes.
+    :param max_age:
+        The number of seconds after which a cached file is revalidated
+        with its upstream server, using the ETag or the modification
+        time received with it.
+    """
+
+    def __init__(self, directory, max_size, max_age=MAX_AGE):
+        self._directory = directory
+        self._max_size = max_size
+        self._max_age = max_age
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._secret = self._load_secret()
+
+    def _load_secret(self):
+        """Get the secret of the cache, creating it if needed.
+
+        The secret is shared by all the argus processes which
+        use the same cache directory.
+        """
+        path = os.path.join(self._directory, _SECRET_NAME)
+        file_desc, temp = tempfile.mkstemp(dir=self._directory,
+                                           prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(file_desc, "wb") as stream:
+                stream.write(binascii.hexlify(os.urandom(32)))
+            # Linking fails if another process already made the secret.
+            os.link(temp, path)
+        except OSError as exc:
+            if exc.errno != errno.EEXIST:
+                raise
+        finally:
+            os.remove(temp)
+        with open(path, "rb") as stream:
+            return stream.read()
+
+    def sign(self, url):
+        """Get the signature which allows the given URL to be fetched."""
+        if isinstance(url, six.text_type):
+            url = url.encode("utf-8")
+        return hmac.new(self._secret, url, hashlib.sha256).hexdigest()
+
+    def verify(self, url, signature):
+        """Check that the given signature was made for the URL."""
+        if isinstance(signature, six.text_type):
+            signature = signature.encode("utf-8")
+        expected = self.sign(url).encode("ascii")
+        return hmac.compare_digest(expected, signature)
+
+    @staticmethod
+    def key(url):
+        if isinstance(url, six.text_type):
+            url = url.encode("utf-8")
+        return hashlib.sha256(url).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self._directory, key)
+
+    def _key_lock(self, key):
+        with self._lock:
+            lock = self._key_locks.get(key)
+            if lock is None:
+                lock = self._key_locks[key] = threading.Lock()
+            return lock
+
+    def _load_metadata(self, key):
+        path = self.path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path + _METADATA_SUFFIX) as stream:
+                return json.load(stream)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def _write_atomically(self, path, chunks):
+        file_desc, temp = tempfile.mkstemp(dir=self._directory,
+                                           prefix=_TEMP_PREFIX)
+        try:
+            with os.fdopen(file_desc, "wb") as stream:
+                for chunk in chunks:
+                    stream.write(chunk)
+            os.rename(temp, path)
+        except Exception:
+            os.remove(temp)
+            raise
+
+    def _store(self, key, url, response):
+        digest = hashlib.sha256()
+        size = [0]
+
+        def chunks():
+            for chunk in response.iter_content(CHUNK_SIZE):
+                digest.update(chunk)
+                size[0] += len(chunk)
+                yield chunk
+
+        self._write_atomically(self.path(key), chunks())
+        metadata = {
+            "url": url,
+            "size": size[0],
+            "etag": '"{}"'.format(digest.hexdigest()),
+            "upstream_etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content_type": response.headers.get(
+                "Content-Type", "application/octet-stream"),
+            "validated": time.time(),
+        }
+        self._save_metadata(key, metadata)
+        LOG.info("Cached %d bytes from %s.", size[0], url)
+        return metadata
+
+    def _save_metadata(self, key, metadata):
+        data = json.dumps(metadata).encode("utf-8")
+        self._write_atomically(self.path(key) + _METADATA_SUFFIX, [data])
+
+    def _revalidate(self, key, url, metadata):
+        headers = {}
+        if metadata:
+            if metadata.get("upstream_etag"):
+                headers["If-None-Match"] = metadata["upstream_etag"]
+            if metadata.get("last_modified"):
+                headers["If-Modified-Since"] = metadata["last_modified"]
+        try:
+            response = requests.get(url, headers=headers, stream=True,
+                                    timeout=FETCH_TIMEOUT)
+        except requests.RequestException as exc:
+            if metadata is None:
+                raise
+            LOG.warning("%s can't be revalidated, serving the cached "
+                        "copy: %r", url, exc)
+            return metadata
+
+        with contextlib.closing(response):
+            if metadata is not None and response.status_code == 304:
+                metadata["validated"] = time.time()
+                self._save_metadata(key, metadata)
+                return metadata
+            response.raise_for_status()
+            return self._store(key, url, response)
+
+    def get(self, url):
+        """Get the cached copy of the given URL, fetching it if needed.
+
+        :returns: A tuple of the path of the file and its metadata.
+        """
+        key = self.key(url)
+        with self._key_lock(key):
+            metadata = self._load_metadata(key)
+            if (metadata is None or
+                    time.time() - metadata["validated"] > self._max_age):
+                metadata = self._revalidate(key, url, metadata)
+            # The modification time orders the files for the eviction.
+            os.utime(self.path(key), None)
+        self._evict(keep=key)
+        return self.path(key), metadata
+
+    def _evict(self, keep):
+        with self._lock:
+            entries = []
+            for name in os.listdir(self._directory):
+                if (name.endswith(_METADATA_SUFFIX) or
+                        name.startswith(_TEMP_PREFIX) or
+                        name in (keep, _SECRET_NAME)):
+                    continue
+                try:
+                    stat = os.stat(self.path(name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            if os.path.exists(self.path(keep)):
+                total += os.path.getsize(self.path(keep))
+
+            for _, size, name in sorted(entries):
+                if total <= self._max_size:
+                    break
+                LOG.debug("Evicting %s from the cache.", name)
+                for path in (self.path(name),
+                             self.path(name) + _METADATA_SUFFIX):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+                total -= size
+
+
+class ResourceServer(object):
+    """The resource server of the host.
+
+    :param host_address: The address of the host, as seen by instances.
+    :param port: The port of the server.
+    :param cache_dir: The directory of the cached files.
+    :param cache_size: The maximum size of the cached files, in bytes.
+    """
+
+    def __init__(self, host_address, port, cache_dir, cache_size):
+        self._host_address = host_address
+        self._port = port
+        self._cache = DiskCache(cache_dir, cache_size)
+        self._manager = None
+
+    @property
+    def url(self):
+        return "http://{}:{}".format(self._host_address, self._port)
+
+    def _ping(self):
+        """Check whether an argus resource server is already running.
+
+        :raises:
+            `ArgusError` if the port is used by something else, including
+            the server of an argus with another cache directory.
+        """
+        try:
+            response = requests.get(self.url + "/ping",
+                                    timeout=PING_TIMEOUT)
+        except requests.RequestException:
+            return False
+        identity = service_mock.RESOURCE_SERVER_ID
+        expected = "{} {}".format(identity, self._cache.sign(identity))
+        if response.status_code != 200 or response.text != expected:
+            raise exceptions.ArgusError(
+                "Port {} is used by another service than the resource "
+                "server of argus.".format(self._port))
+        return True
+
+    def start(self):
+        """Start the server, unless another argus process runs it."""
+        if self._ping():
+            LOG.info("Using the resource server already running on "
+                     "port %d.", self._port)
+            return
+
+        service = cloud_windows.named(
+            application=service_mock.ResourceServerApp, script_name="",
+            host=self._host_address, port=self._port)
+        self._manager = service_mock.ServiceManager([service], self._cache)
+        LOG.info("Started the resource server at %s.", self.url)
+
+    def stop(self):
+        if self._manager is not None:
+            self._manager.terminate()
+            self._manager = None
+
+    def resource_url(self, resource_location):
+        """Get the URL of a resource of argus."""
+        return "{}/resources/{}".format(self.url, resource_location)
+
+    def cache_url(self, url):
+        """Get the URL of the cached copy of a remote file.
+
+        Only the URLs given here are fetched by the server.
+        """
+        return "{}/cache/{}/{}".format(self.url, self._cache.sign(url),
+                                       service_mock.encode_url(url))
+
+    def rewrite(self, uri):
+        """Get the URI which should be downloaded instead of the given one.
+
+        Only the HTTP URIs which don't already point to the server
+        are rewritten.
+        """
+        if not uri.startswith(("http://", "https://")):
+            return uri
+        if uri.startswith(self.url + "/"):
+            return uri
+        return self.cache_url(uri)
+
+
+def get_resource_server():
+    """Get the resource server, starting it on first use.
+
+    :returns:
+        A :class:`ResourceServer`, or None if it isn't enabled
+        in the configuration.
+    """
+    global _SERVER  # pylint: disable=global-statement
+    conf = util.get_config()
+    if not conf.argus.resource_server:
+        return None
+    with _SERVER_LOCK:
+        if _SERVER is None:
+            server = ResourceServer(
+                util.get_local_ip(), conf.argus.resource_server_port,
+                conf.argus.resource_cache_dir,
+                conf.argus.resource_cache_size * 1024 * 1024)
+            try:
+                server.start()
+            except exceptions.ArgusError as exc:
+                LOG.warning("The resource server can't be used: %s", exc)
+                _SERVER = False
+            else:
+                atexit.register(server.stop)
+                _SERVER = server
+        return _SERVER or None
@@ -13,6 +13,8 @@
 #    License for the specific language governing permissions and limitations
 #    under the License.
 
+import base64
+import hashlib
 import json
 import multiprocessing
 import textwrap
@@ -20,6 +22,9 @@ import time
 import warnings
 
 import cherrypy
+from cherrypy.lib import cptools
+from cherrypy.lib import static
+import six
 # pylint: disable=import-error
 from six.moves import http_client
 from six.moves import urllib
@@ -29,6 +34,9 @@ from argus import util
 
 CLOUDSTACK_EXPECTED_HEADER = "Domu-Request"
 STOP_LINK_RETRY_COUNT = 5
+# Answered by the resource server, so that another argus
+# process can tell that it can use it.
+RESOURCE_SERVER_ID = "argus-resource-server"
 
 
 def _create_service_server(service, backend):
@@ -56,6 +64,23 @@ def _instantiate_services(services, backend):
         yield process
 
 
+def encode_url(url):
+    """Encode an URL as a single segment of a path."""
+    if isinstance(url, six.text_type):
+        url = url.encode("utf-8")
+    encoded = base64.urlsafe_b64encode(url)
+    if six.PY3:
+        encoded = encoded.decode()
+    return encoded
+
+
+def decode_url(encoded):
+    """Decode an URL encoded with :func:`encode_url`."""
+    if isinstance(encoded, six.text_type):
+        encoded = encoded.encode("ascii")
+    return base64.urlsafe_b64decode(encoded).decode("utf-8")
+
+
 class ServiceManager(object):
     """Creates the required mocked service processes."""
 
@@ -288,3 +313,58 @@ class HTTPKeysMetadataServiceApp(BaseServiceApp):
             # Handle invalid and password posting cases.
             raise cherrypy.HTTPError(404)
         return json.dumps(self._get_metadata)
+
+
+class ResourceServerApp(BaseServiceApp):
+    """Serve the resources of argus and cached remote files.
+
+    The application receives a
+    :class:`argus.scenarios.cloud.resource_server.DiskCache`
+    instead of a backend.
+    """
+
+    def __init__(self, cache):
+        super(ResourceServerApp, self).__init__(cache)
+        self._cache = cache
+
+    @staticmethod
+    def _check_etag(etag):
+        cherrypy.response.headers["ETag"] = etag
+        # Answers with 304 if the client already has this version.
+        cptools.validate_etags()
+
+    @cherrypy.expose
+    def resources(self, *parts):
+        if not parts or ".." in parts:
+            raise cherrypy.HTTPError(404)
+        try:
+            data = util.get_resource("/".join(parts))
+        except (IOError, OSError):
+            raise cherrypy.HTTPError(404)
+        self._check_etag('"{}"'.format(hashlib.sha256(data).hexdigest()))
+        cherrypy.response.headers["Content-Type"] = "application/octet-stream"
+        return data
+
+    @cherrypy.expose
+    def ping(self):
+        return "{} {}".format(RESOURCE_SERVER_ID,
+                              self._cache.sign(RESOURCE_SERVER_ID))
+
+    @cherrypy.expose
+    def cache(self, signature, encoded_url):
+        try:
+            url = decode_url(encoded_url)
+        except (TypeError, ValueError):
+            raise cherrypy.HTTPError(400, "Malformed URL")
+        if not self._cache.verify(url, signature):
+            raise cherrypy.HTTPError(403, "The URL wasn't given by argus")
+        if not url.startswith(("http://", "https://")):
+            raise cherrypy.HTTPError(400, "Only HTTP URLs can be cached")
+        try:
+            path, metadata = self._cache.get(url)
+        except Exception as exc:  # pylint: disable=broad-except
+            raise cherrypy.HTTPError(
+                502, "{} can't be fetched: {!r}".format(url, exc))
+        self._check_etag(metadata["etag"])
+        return static.serve_file(path,
+                                 content_type=metadata["content_type"])
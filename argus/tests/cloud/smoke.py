@@ -50,11 +50,11 @@ class BaseTestPassword(base.BaseTestCase):
 
     def _run_remote_command(self, cmd, password):
         # Test that the proper password was set.
-        remote_client = self._backend.get_remote_client(
-            self._conf.cloudbaseinit.created_user, password)
-
-        stdout = remote_client.run_command_verbose(
-            cmd, command_type=util.CMD)
+        with self._backend.get_remote_client(
+                self._conf.cloudbaseinit.created_user,
+                password) as remote_client:
+            stdout = remote_client.run_command_verbose(
+                cmd, command_type=util.CMD)
         return stdout
 
     def is_password_set(self, password):
@@ -165,9 +165,7 @@ class TestCloudstackUpdatePasswordSmoke(base.BaseTestCase):
 
         return False
 
-    def _wait_for_completion(self, password):
-        remote_client = self._backend.get_remote_client(
-            self._conf.cloudbaseinit.created_user, password)
+    def _wait_for_completion(self, remote_client):
         remote_client.manager.wait_cbinit_service()
 
     def _test_password(self, password, expected):
@@ -175,11 +173,17 @@ class TestCloudstackUpdatePasswordSmoke(base.BaseTestCase):
         response = self._update_password(password)
         self.assertEqual(200, response)
 
-        # Reboot the instance.
-        self._backend.reboot_instance()
-
-        # Check if the password was set properly.
-        self._wait_for_completion(expected)
+        # Reboot the instance. The client is ready when the expected
+        # password can be used for logging in after the reboot.
+        with self._backend.get_remote_client(
+                self._conf.cloudbaseinit.created_user,
+                expected) as remote_client:
+            remote_client.expect_reboot()
+            self._backend.reboot_instance()
+            remote_client.wait_for_reboot()
+
+            # Check if the password was set properly.
+            self._wait_for_completion(remote_client)
 
     def test_update_password(self):
         # Get the password from the metadata.
@@ -24,24 +24,6 @@ from argus import exceptions
 from argus import util
 
 
-def _parse_licenses(output):
-    """Parse the licenses information.
-
-    It will return a dictionary of products and their
-    license status.
-    """
-    licenses = {}
-
-    # We are starting from 2, since the first line is the
-    # list of fields and the second one is a separator.
-    # We can't use csv to parse this, unfortunately.
-    for line in output.strip().splitlines()[2:]:
-        product, _, status = line.rpartition(" ")
-        product = product.strip()
-        licenses[product] = status
-    return licenses
-
-
 class TestSmoke(smoke.TestsBaseSmoke):
     """Test additional Windows specific behaviour."""
 
@@ -65,25 +47,20 @@ class TestSmoke(smoke.TestsBaseSmoke):
 
     def test_licensing(self):
         # Check that the instance OS was licensed properly.
-        command = ('Get-WmiObject SoftwareLicensingProduct | '
-                   'where PartialProductKey | Select Name, LicenseStatus')
-        stdout = self._backend.remote_client.run_command_verbose(
-                command, command_type=util.POWERSHELL)
-        licenses = _parse_licenses(stdout)
+        licenses = self._introspection.get_licenses()
         if len(licenses) > 1:
             self.fail("Too many expected products in licensing output.")
 
-        license_status = list(licenses.values())[0]
-        self.assertEqual(1, int(license_status))
+        self.assertEqual(1, int(licenses[0].status))
 
     def test_https_winrm_configured(self):
         # Test that HTTPS transport protocol for WinRM is configured.
         # By default, the test images are built only for HTTP.
-        remote_client = self._backend.get_remote_client(
-            self._conf.openstack.image_username,
-            self._conf.openstack.image_password,
-            protocol='https')
-        stdout = remote_client.run_command_verbose(
+        with self._backend.get_remote_client(
+                self._conf.openstack.image_username,
+                self._conf.openstack.image_password,
+                protocol='https') as remote_client:
+            stdout = remote_client.run_command_verbose(
                 'echo 1', command_type=util.CMD)
         self.assertEqual('1', stdout.strip())
 
@@ -152,10 +129,10 @@ class TestCertificateWinRM(base.BaseTestCase):
             "argus.resources", "cert.pem")
         cert_key = pkg_resources.resource_filename(
             "argus.resources", "key.pem")
-        client = self._backend.get_remote_client(cert_pem=cert_pem,
-                                                 cert_key=cert_key)
-        stdout = client.run_command_verbose(
-            "echo 1", command_type=util.CMD)
+        with self._backend.get_remote_client(cert_pem=cert_pem,
+                                             cert_key=cert_key) as client:
+            stdout = client.run_command_verbose(
+                "echo 1", command_type=util.CMD)
         self.assertEqual(stdout.strip(), "1")
 
 
@@ -164,10 +141,10 @@ class TestNextLogonPassword(base.BaseTestCase):
     password_expired_flag = 1
 
     def _wait_for_completion(self):
-        remote_client = self._backend.get_remote_client(
-            self._conf.openstack.image_username,
-            self._conf.openstack.image_password)
-        remote_client.manager.wait_boot_completion()
+        with self._backend.get_remote_client(
+                self._conf.openstack.image_username,
+                self._conf.openstack.image_password) as remote_client:
+            remote_client.manager.wait_boot_completion()
 
     def test_next_logon_password_not_changed(self):
         self._wait_for_completion()
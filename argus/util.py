@@ -300,6 +300,19 @@ def get_command(command, command_type=None):
     return modifier(command)
 
 
+def b64encode(data):
+    """Encode the given data in base64, returning a native string.
+
+    Text is encoded in UTF-8 first, bytes are encoded as they are.
+    """
+    if isinstance(data, six.text_type):
+        data = data.encode("utf-8")
+    encoded = base64.b64encode(data)
+    if six.PY3:
+        encoded = encoded.decode()
+    return encoded
+
+
 LOG = get_logger()
 
 _BUILDS = ["Beta", "Stable", "test"]